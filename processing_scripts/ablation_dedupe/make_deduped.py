@@ -1,67 +1,35 @@
 import lm_dataformat as lmd
 from glob import glob
-import re
+import os
+import argparse
+import multiprocessing as mp
 from tqdm import tqdm
 
-ngrams_to_exclude = set()
+from the_pile.utils import fread
+from the_pile.decontaminate import build_excludes, process_doc
+from the_pile.dedupe import load_index
 
+import numpy as np
 
-def hash(s):
-    return 
 
+parser = argparse.ArgumentParser(description='Remove n-grams that occur in eval sets from training data.')
+parser.add_argument('--excludes', type=str, default='excludes/*')
+parser.add_argument('--n', type=int, default=13)
+parser.add_argument('--index', type=str, help='cache of the hashed exclude n-grams')
+parser.add_argument('--workers', type=int, default=mp.cpu_count())
+args = parser.parse_args()
 
-def ngrams(txt, n):
-    pos = 0
-    words = re.split(r'\s', txt.lower())
+if args.index is None:
+    args.index = 'excludes_{}gram.npy'.format(args.n)
 
-    arr = []
-    for word in words:
-        arr.append((word, pos))
-        pos += len(word)
 
-    arr = list(filter(lambda x: x[0].strip(), arr))
+def init_process():
+    global ngrams_to_exclude
+    ngrams_to_exclude = load_index(args.index)
 
-    for i in range(len(arr) - n):
-        yield arr[i:i+n]
 
-
-for f in glob('excludes/*'):
-    with open(f) as fh:
-        doc = fh.read()
-        ngs = ngrams(doc, 13)
-        for ngram in ngs:
-            ngrams_to_exclude.add(' '.join([x[0] for x in ngram]))
-
-
-def process_doc(txt, n=13):
-    ngs = ngrams(txt, n)
-    res = []
-    delspans = []
-    for ngram in ngs:
-        joinedn = ' '.join([x[0] for x in ngram])
-        if joinedn in ngrams_to_exclude:
-            delspans.append((max(0, ngram[0][1] - 200), min(len(txt), ngram[-1][1] + 200)))
-    
-    if len(delspans) == 0: return [txt]
-    
-    ptr = 0
-    result = []
-    for l, r in delspans:
-        if ptr < l:
-            result.append(txt[ptr:l])
-            ptr = r
-        if l <= ptr < r:
-            ptr = r
-        if r < ptr:
-            raise AssertionError()
-    
-    result.append(txt[ptr:])
-
-    result = list(filter(lambda x: len(x) > 200, result))
-
-    if len(result) > 10: return []
-
-    return result
+def process(doc):
+    return process_doc(doc, ngrams_to_exclude, n=args.n)
 
 
 chunk_docs = 50000
@@ -72,14 +40,19 @@ dsets = [
     ('output_owt', '/data/datasets/openwebtext'),
 ]
 
-for outdir, source in dsets:
-    ar = lmd.Archive(outdir)
-    for i, doc in enumerate(tqdm(lmd.Reader(source).stream_data())):
-        for piece in process_doc(doc):
-            ar.add_data(piece)
+if __name__ == '__main__':
+    if not os.path.exists(args.index):
+        np.save(args.index, build_excludes(map(fread, glob(args.excludes)), n=args.n))
 
-        if (i + 1) % chunk_docs == 0:
-            ar.commit()
+    with mp.Pool(args.workers, initializer=init_process) as pool:
+        for outdir, source in dsets:
+            ar = lmd.Archive(outdir)
+            docs = lmd.Reader(source).stream_data()
+            for i, pieces in enumerate(tqdm(pool.imap(process, docs, chunksize=64))):
+                for piece in pieces:
+                    ar.add_data(piece)
 
-    ar.commit()
-        
\ No newline at end of file
+                if (i + 1) % chunk_docs == 0:
+                    ar.commit()
+
+            ar.commit()
@@ -0,0 +1,40 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from the_pile.utils import iter_json_array
+
+
+parser = argparse.ArgumentParser(description='Compare json.load against iter_json_array on a Wikipedia output file.')
+parser.add_argument('file', type=str, help='one of components/wikipedia_en/output/*.json')
+parser.add_argument('--loader', type=str, choices=['json', 'stream'], help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+
+def run(loader):
+    start = time.perf_counter()
+    first = None
+    n = 0
+    with open(args.file) as fh:
+        docs = json.load(fh) if loader == 'json' else iter_json_array(fh)
+        for doc in docs:
+            if first is None:
+                first = time.perf_counter() - start
+            n += 1
+
+    total = time.perf_counter() - start
+    # ru_maxrss is in KiB on linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({'loader': loader, 'docs': n, 'first_doc_s': first, 'total_s': total, 'peak_rss_mib': rss}))
+
+
+if __name__ == '__main__':
+    if args.loader:
+        run(args.loader)
+    else:
+        # separate processes so each loader's peak RSS is measured on its own
+        for loader in ['json', 'stream']:
+            subprocess.run([sys.executable, __file__, args.file, '--loader', loader], check=True)
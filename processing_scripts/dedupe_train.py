@@ -1,61 +1,36 @@
 from the_pile.utils import *
-import random
+from the_pile.dedupe import build_index, load_index, contains, digests
+from the_pile.shards import process_shards
 import os
+import argparse
+import multiprocessing as mp
 from tqdm import tqdm
-import shutil
-import zstandard
-import io
-import parse
 
-import sys
+from glob import glob
 
 
-from glob import glob
+parser = argparse.ArgumentParser(description='Remove exact duplicates of held out documents from the train set.')
+parser.add_argument('--holdout', type=str, default='/mnt/data/pile_holdout/*.zst')
+parser.add_argument('--train', type=str, default='train/*')
+parser.add_argument('--output', type=str, default='train2')
+parser.add_argument('--index', type=str, default='holdout_index.npy')
+parser.add_argument('--workers', type=int, default=mp.cpu_count())
+args = parser.parse_args()
+
+
+def init_process():
+    global index
+    index = load_index(args.index)
+
+
+def dedupe(batch):
+    seen = contains(index, digests(batch))
+    return [line for line, dupe in zip(batch, seen) if not dupe]
 
 
+if __name__ == '__main__':
+    if not os.path.exists(args.index):
+        build_index(tqdm(glob(args.holdout)), args.index)
 
-def readf(f):
-    with open(f, 'rb') as fh:
-        cctx = zstandard.ZstdDecompressor()
-        reader = io.BufferedReader(cctx.stream_reader(fh))
-        yield from tqdm(reader)
-
-
-def writef(f, lines):
-    with open(f, 'wb') as fh:
-        cctx = zstandard.ZstdCompressor(level=3, threads=8)
-        compressor = cctx.stream_writer(fh)
-        for line in tqdm(lines):
-            compressor.write(line)
-        compressor.flush(zstandard.FLUSH_FRAME)
-
-seen = set()
-
-if os.path.exists('hashes.txt'):
-    with open('hashes.txt') as fh:
-        for line in tqdm(fh):
-            seen.add(line.strip())
-else:
-    hashf = open('hashes.txt', 'w')
-    for f in tqdm(glob('/mnt/data/pile_holdout/*.zst')):
-        for doc in readf(f):
-            hash = sha256str(doc)
-            hashf.write(hash + '\n')
-            seen.add(hash)
-    hashf.close()
-
-os.makedirs('train', exist_ok=True)
-
-for f in tqdm(glob('train/*')):
-    def filtered_docs():
-        removed = 0
-        for doc in readf(f):
-            hash = sha256str(doc)
-            if hash in seen:
-                removed += 1
-                if removed % 1000 == 0:
-                    print(removed)
-            else:
-                yield doc
-    writef('train2/' + f.split('/')[-1], filtered_docs())
-    
+    totals = process_shards(dedupe, glob(args.train), out_dir=args.output, mode='batch', workers=args.workers, initializer=init_process)
+    print('removed', totals['in'] - totals['out'])
@@ -1,33 +1,12 @@
-from the_pile.utils import *
-import random
-import os
-from tqdm import tqdm
-import shutil
-import zstandard
-import io
-import json
+from the_pile.shards import process_shards
+import argparse
+import multiprocessing as mp
 
-import sys
 
-
-f = sys.argv[1]
-
-fout = 'tmp'
-
-def readf(f):
-    with open(f, 'rb') as fh:
-        cctx = zstandard.ZstdDecompressor()
-        reader = io.BufferedReader(cctx.stream_reader(fh))
-        yield from tqdm(reader)
-
-
-def writef(f, lines):
-    with open(f, 'wb') as fh:
-        cctx = zstandard.ZstdCompressor(level=3, threads=8)
-        compressor = cctx.stream_writer(fh)
-        for line in tqdm(lines):
-            compressor.write(line)
-        compressor.flush(zstandard.FLUSH_FRAME)
+parser = argparse.ArgumentParser(description='Remove the spaces interleaved into DM Mathematics documents, in place.')
+parser.add_argument('files', type=str, nargs='+')
+parser.add_argument('--workers', type=int, default=mp.cpu_count())
+args = parser.parse_args()
 
 
 def despace(x):
@@ -43,19 +22,16 @@ def despace(x):
     return ''.join(res)
 
 
-def fix(x):
+def fix(rec):
     # optimization
-    if b'DM Mathematics' not in x: return x
-
-    ob = json.loads(x)
-
-    if ob['meta']['pile_set_name'] != 'DM Mathematics': return x
+    if b'DM Mathematics' not in rec.line: return rec
 
-    ob['text'] = despace(ob['text'])
+    if rec.meta['pile_set_name'] != 'DM Mathematics': return rec
 
-    return (json.dumps(ob).strip() + '\n').encode('utf-8')
+    rec.text = despace(rec.text)
 
+    return rec
 
-writef(fout, map(fix, readf(f)))
-sh('mv tmp ' + f)
 
+if __name__ == '__main__':
+    process_shards(fix, args.files, name='fix_dm_math', parse='lazy', workers=args.workers)
@@ -1,38 +1,17 @@
-from the_pile.utils import *
-import random
-import os
-from tqdm import tqdm
-import shutil
-import zstandard
-import io
-import parse
+from the_pile.shards import process_shards
+import argparse
+import multiprocessing as mp
 
-import sys
 
-
-f = sys.argv[1]
-
-fout = 'tmp'
-
-def readf(f):
-    with open(f, 'rb') as fh:
-        cctx = zstandard.ZstdDecompressor()
-        reader = io.BufferedReader(cctx.stream_reader(fh))
-        yield from tqdm(reader)
-
-
-def writef(f, lines):
-    with open(f, 'wb') as fh:
-        cctx = zstandard.ZstdCompressor(level=3, threads=8)
-        compressor = cctx.stream_writer(fh)
-        for line in tqdm(lines):
-            compressor.write(line)
-        compressor.flush(zstandard.FLUSH_FRAME)
+parser = argparse.ArgumentParser(description='Drop empty lines from lmd archives, in place.')
+parser.add_argument('files', type=str, nargs='+')
+parser.add_argument('--workers', type=int, default=mp.cpu_count())
+args = parser.parse_args()
 
 
 def cont(x):
     return x.strip()
 
 
-writef(fout, filter(cont, readf(f)))
-sh('mv tmp ' + f)
+if __name__ == '__main__':
+    process_shards(cont, args.files, name='fix_empty_lines', mode='filter', workers=args.workers)
@@ -1,8 +1,7 @@
 import lm_dataformat as lmd
 from glob import glob
 import os
-import json
-import collections
+import argparse
 from tqdm import tqdm
 
 import transformers
@@ -10,53 +9,54 @@ import re
 from best_download import download_file
 import fasttext
 
-import zstandard
 import multiprocessing as mp
 
+from the_pile.columns import write_columns
+from the_pile.utils import batched
 
-in_path = 'pile'
-out_path = 'langlen_stage1'
 
+parser = argparse.ArgumentParser(description='Per-document length and language analysis, pass 1.')
+parser.add_argument('--in_path', type=str, default='pile')
+parser.add_argument('--out_path', type=str, default='langlen_stage1')
+parser.add_argument('--workers', type=int, default=30)
+parser.add_argument('--batch_size', type=int, default=1024)
+args = parser.parse_args()
 
-def lengths(doc):
+
+# one directory per input file, holding a .npy per column; string columns are stored as indices into dictionary.json
+INT_COLUMNS = ['len_char', 'len_utf8bytes', 'len_words', 'len_tokens']
+STR_COLUMNS = ['pile_set_name', 'lang']
+
+whitespace = re.compile(r'\s+')
+
+
+def lengths(docs):
     global tok
     return {
-        'len_char': len(doc),
-        'len_utf8bytes': len(doc.encode('utf-8')),
-        'len_words': len(re.split(r'\s+', doc)),
-        'len_tokens': len(tok.encode(doc)),
+        'len_char': [len(doc) for doc in docs],
+        'len_utf8bytes': [len(doc.encode('utf-8')) for doc in docs],
+        'len_words': [len(whitespace.split(doc)) for doc in docs],
+        'len_tokens': [len(ids) for ids in tok(docs)['input_ids']],
     }
 
 
-download_file('https://dl.fbaipublicfiles.com/fasttext/supervised-models/lid.176.bin', 'lid.176.bin', '7e69ec5451bc261cc7844e49e4792a85d7f09c06789ec800fc4a44aec362764e')
-
-
-def language(doc):
+def language(docs):
     global langdet
-    details = langdet.predict(doc.replace('\n', ' '), k=1)
+    labels, _ = langdet.predict([doc.replace('\n', ' ') for doc in docs], k=1)
 
     return {
-        'lang': details[0][0].replace('__label__', '')
+        'lang': [label[0].replace('__label__', '') for label in labels]
     }
 
 
-def writef(f, lines):
-    with open(f, 'wb') as fh:
-        cctx = zstandard.ZstdCompressor(level=3, threads=8)
-        compressor = cctx.stream_writer(fh)
-        for line in tqdm(lines):
-            compressor.write(line)
-        compressor.flush(zstandard.FLUSH_FRAME)
-
-
-def analyze(ob):
-    doc, meta = ob
+def analyze(batch):
+    docs = [doc for doc, _ in batch]
     res = {
-        'pile_set_name': meta['pile_set_name']
+        'pile_set_name': [meta['pile_set_name'] for _, meta in batch]
     }
     for metric in metrics:
-        res = {**res, **metric(doc)}
-    return json.dumps(res).encode('utf-8')
+        res = {**res, **metric(docs)}
+    return res
 
 
 metrics = [
@@ -72,14 +72,16 @@ def init_process():
     tok = transformers.GPT2TokenizerFast.from_pretrained('gpt2')
 
 
-pool = mp.Pool(30, initializer=init_process)
+if __name__ == '__main__':
+    download_file('https://dl.fbaipublicfiles.com/fasttext/supervised-models/lid.176.bin', 'lid.176.bin', '7e69ec5451bc261cc7844e49e4792a85d7f09c06789ec800fc4a44aec362764e')
+    os.makedirs(args.out_path, exist_ok=True)
+
+    pool = mp.Pool(args.workers, initializer=init_process)
 
+    for f in tqdm(sorted(glob(args.in_path + '/*'))):
+        outdir = args.out_path + '/analysis_' + f.split('/')[-1]
+        if os.path.exists(outdir): continue
 
-for f in tqdm(sorted(glob(in_path + '/*'))):
-    if os.path.exists(out_path + '/analysis_' + f.split('/')[-1]): continue
-    def meta_items():
         rdr = lmd.Reader(f)
-        return pool.imap(analyze, rdr.stream_data(get_meta=True)) 
-    
-    writef(out_path + '/tmp_analysis_' + f.split('/')[-1], meta_items())
-    os.rename(out_path + '/tmp_analysis_' + f.split('/')[-1], out_path + '/analysis_' + f.split('/')[-1])
+        results = pool.imap(analyze, batched(rdr.stream_data(get_meta=True), args.batch_size))
+        write_columns(outdir, tqdm(results), INT_COLUMNS, STR_COLUMNS)
@@ -1,21 +1,21 @@
 from glob import glob
-import random
 import os
 from tqdm import tqdm
-import shutil
-import zstandard
 import json
-import io
+import argparse
 
-import sys
-import math
+import collections
+import numpy as np
+import multiprocessing as mp
 
+from the_pile.sketches import Sketches, Moments, LogHistogram, CountMap
+from the_pile.columns import read_columns
 
-def readf(f):
-    with open(f, 'rb') as fh:
-        cctx = zstandard.ZstdDecompressor()
-        reader = io.BufferedReader(cctx.stream_reader(fh))
-        yield from reader
+
+parser = argparse.ArgumentParser(description='Per-document length and language analysis, pass 2.')
+parser.add_argument('--in_path', type=str, default='langlen_stage1')
+parser.add_argument('--workers', type=int, default=mp.cpu_count())
+args = parser.parse_args()
 
 
 rewritenames = {
@@ -31,47 +31,45 @@ def rewrite_name(n):
 
     return n
 
-import collections
+ATTRS = ['len_char', 'len_utf8bytes', 'len_words', 'len_tokens', 'bytes_per_token', 'words_per_token']
 
-dat = collections.defaultdict(list)
 
-set_names = set()
+def attr_values(cols, attr):
+    """ Values of attr and the component of each; the per-token ratios only exist for documents with tokens. """
+    if attr in ['bytes_per_token', 'words_per_token']:
+        has_tokens = cols['len_tokens'] > 0
+        numer = cols['len_utf8bytes' if attr == 'bytes_per_token' else 'len_words'][has_tokens]
+        return numer / cols['len_tokens'][has_tokens], cols['pile_set_name'][has_tokens]
+    return cols[attr], cols['pile_set_name']
 
 
-for f in tqdm(glob('langlen_stage1/*')[:1]):
-    # forgot to add \n in stage1 >.>
-    for x in map(lambda x: x + b'}', (list(next(readf(f)).split(b'}'))[:-1])): 
-        ob = json.loads(x)
-        setname = rewrite_name(ob['pile_set_name'])
-        #print(ob)
-        for attr in ['len_char', 'len_utf8bytes', 'len_words', 'len_tokens', 'lang']:
-            dat[(setname, attr)].append(ob[attr])
-            dat[('Pile', attr)].append(ob[attr])
-            set_names.add(setname)
-        
-        if ob['len_tokens'] > 0:
-            dat[(setname, 'bytes_per_token')].append(ob['len_utf8bytes'] / ob['len_tokens'])
-            dat[('Pile', 'bytes_per_token')].append(ob['len_utf8bytes'] / ob['len_tokens'])
+def shard_sketches(d):
+    """ Sketches of one pass 1 output, per component and for the whole Pile. Saved next to the columns, so
+    rerunning only has to look at new outputs. """
+    if os.path.exists(d + '/sketches.json'):
+        return Sketches.load(d + '/sketches.json')
 
-            dat[(setname, 'words_per_token')].append(ob['len_words'] / ob['len_tokens'])
-            dat[('Pile', 'words_per_token')].append(ob['len_words'] / ob['len_tokens'])
-        
-set_names = list(set_names)
-set_names.append('Pile')
-        
-def mean(x):
-    return sum(x) / len(x)
+    cols, dictionary = read_columns(d, ['len_char', 'len_utf8bytes', 'len_words', 'len_tokens', 'pile_set_name', 'lang'])
+    set_names = [rewrite_name(x) for x in dictionary['pile_set_name']]
+    langs = np.array(dictionary['lang'] or [''])[cols['lang']]
 
-def stddev(x):
-    mu = mean(x)
-    return math.sqrt(mean([(v - mu) ** 2 for v in x]))
+    sketches = Sketches()
+    for attr in ATTRS:
+        x, sets = attr_values(cols, attr)
+        for k in np.unique(sets).tolist():
+            for sname in [set_names[k], 'Pile']:
+                sketches.get((sname, attr), Moments).update(x[sets == k])
+                sketches.get((sname, attr, 'hist'), LogHistogram).update(x[sets == k])
+    for k in np.unique(cols['pile_set_name']).tolist():
+        for sname in [set_names[k], 'Pile']:
+            sketches.get((sname, 'lang'), CountMap).update(langs[cols['pile_set_name'] == k])
 
-def freqs(x):
-    ret = collections.defaultdict(int)
-    for v in x:
-        ret[v] += 1
-    
-    return ret
+    sketches.save(d + '/sketches.json')
+    return sketches
+
+
+def freqs(sname):
+    return sketches[sname, 'lang'].counts
 
 def filter_freqs(x, minpass):
     total = sum(x.values())
@@ -98,10 +96,14 @@ nicename = {
 import matplotlib.pyplot as plt
 import numpy as np
 
-def histogram(x, sname, attr):
+def histogram(hist, sname, attr):
+    # drop the top 1% like the outliers used to be
+    edges = hist.edges()
+    end = int(np.searchsorted(edges, hist.quantile(0.99), side='right'))
+    counts = hist.counts[:end]
     plt.clf()
     plt.cla()
-    plt.hist(x, density=True, bins=100) 
+    plt.stairs(counts / max(1, counts.sum()) / np.diff(edges[:end + 1]), edges[:end + 1], fill=True)
     #plt.ylabel('Probability Density')
     plt.xlabel('{} ({})'.format(nicename[attr], sname))
     plt.savefig('figures/analysis_{}_{}.png'.format(sname, attr),bbox_inches='tight')
@@ -151,28 +153,34 @@ def format_freqs(d):
     return '\n'.join(res)
 
 
-def rm_outliers_trunc_1p(x):
-    x = list(sorted(x))
-    return x[:len(x)*99//100]
-
-
-summary = collections.defaultdict(dict)
-
-print('bytes per token, all:', sum(dat[('Pile', 'len_utf8bytes')]) / sum(dat[('Pile', 'len_tokens')]))
-
-for sname in set_names:
-    print('**' + sname + '**')
-    for attr in ['len_char', 'len_utf8bytes', 'len_words', 'len_tokens', 'bytes_per_token', 'words_per_token']:
-        mu, sigma = mean(dat[(sname,attr)]), stddev(dat[(sname,attr)])
-        print('{}: {:.4f}±{:.4f}'.format(nicename[attr], mu, sigma))
-        #histogram(rm_outliers_trunc_1p(dat[(sname,attr)]), sname, attr)
-        if sname != 'Pile' and (sname != 'Ubuntu IRC' or 'len_' not in attr): summary[attr][sname] = (mu, sigma)
-    
-    #barplot(filter_freqs(freqs(dat[(sname,'lang')]), 0.001), sname, 'lang')
+if __name__ == '__main__':
+    outputs = [d for d in sorted(glob(args.in_path + '/analysis_*')) if not d.endswith('.tmp')]
+    sketches = Sketches()
+    with mp.Pool(args.workers) as pool:
+        for x in tqdm(pool.imap(shard_sketches, outputs), total=len(outputs)):
+            sketches.merge(x)
+
+    set_names = sorted(set(key[0] for key in sketches.keys()) - {'Pile'}) + ['Pile']
+    summary = collections.defaultdict(dict)
+
+    # ratio of the totals, n * mean
+    print('bytes per token, all:', sketches['Pile', 'len_utf8bytes'].mean / sketches['Pile', 'len_tokens'].mean)
+
+    os.makedirs('figures', exist_ok=True)
+    for sname in set_names:
+        print('**' + sname + '**')
+        for attr in ATTRS:
+            if (sname, attr) not in sketches: continue
+            mu, sigma = sketches[sname, attr].mean, sketches[sname, attr].stddev()
+            print('{}: {:.4f}±{:.4f}'.format(nicename[attr], mu, sigma))
+            #histogram(sketches[sname, attr, 'hist'], sname, attr)
+            if sname != 'Pile' and (sname != 'Ubuntu IRC' or 'len_' not in attr): summary[attr][sname] = (mu, sigma)
+        
+        #barplot(filter_freqs(dict(freqs(sname)), 0.001), sname, 'lang')
 
-    print('Langs:')
-    print(format_freqs(freqs(dat[(sname, 'lang')])))
+        print('Langs:')
+        print(format_freqs(freqs(sname)))
 
 
-for attr in ['len_char', 'len_utf8bytes', 'len_words', 'len_tokens', 'bytes_per_token', 'words_per_token']:
-    barplot(summary[attr], 'overview', attr, normalize=False, yerr=True)
\ No newline at end of file
+    for attr in ATTRS:
+        barplot(summary[attr], 'overview', attr, normalize=False, yerr=True)
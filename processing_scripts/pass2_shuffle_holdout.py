@@ -1,51 +1,46 @@
 from the_pile.utils import *
-import random
+from the_pile.shuffle import shuffle_holdout
 import os
+import argparse
+import multiprocessing as mp
 from tqdm import tqdm
-import shutil
-import zstandard
-import io
-import parse
 
-random.seed(42)
 
-for f in ls('pile_pass1'):
-    f = [x for x in ls(f) if 'current_chunk_incomplete' not in x]
-    if len(f) == 1: break
+parser = argparse.ArgumentParser(description='Shuffle each interleaved chunk from pass 1 and split off the holdout set.')
+parser.add_argument('--input', type=str, default='pile_pass1')
+parser.add_argument('--output', type=str, default='pile_output')
+parser.add_argument('--holdout', type=str, default='pile_holdout')
+parser.add_argument('--holdout_frac', type=float, default=0.01)
+parser.add_argument('--mem', type=str, default='96G', help='total RAM budget, split evenly between workers')
+parser.add_argument('--workers', type=int, default=8)
+parser.add_argument('--tmpdir', type=str, default=None, help='where to spill shuffle runs')
+parser.add_argument('--keep_input', action='store_true')
+args = parser.parse_args()
 
-f, = f
-print(f)
 
-fout = 'pile_output/' + parse.parse('{}chunk{}/{}', f)[1] + '.jsonl.zst'
-fouth = 'pile_holdout/' + parse.parse('{}chunk{}/{}', f)[1] + '.jsonl.zst'
+def process_chunk(chunkdir):
+    # sharded builds leave one file per shard in each chunk; they all get shuffled together
+    infiles = [x for x in ls(chunkdir) if 'current_chunk_incomplete' not in x]
+    name = chunkdir.split('chunk')[-1] + '.jsonl.zst'
+    fout = args.output + '/' + name
+    fouth = args.holdout + '/' + name
 
-with open(f, 'rb') as fh, open(fout, 'wb') as fout, open(fouth, 'wb') as fouth:
-    print('reading')
-    cctx = zstandard.ZstdDecompressor()
-    reader = io.BufferedReader(cctx.stream_reader(fh))
-    lines = []
-    for line in tqdm(reader):
-        lines.append(line)
-    
-    random.shuffle(lines)
+    if os.path.exists(fout) or not infiles: return
 
-    pivot = int(len(lines) * 0.01)
+    shuffle_holdout(infiles, fout + '.tmp', fouth + '.tmp', holdout_frac=args.holdout_frac,
+        mem_budget=parse_size(args.mem) / args.workers, tmpdir=args.tmpdir, seed=name)
+    os.rename(fouth + '.tmp', fouth)
+    os.rename(fout + '.tmp', fout)
 
-    holdout = lines[:pivot]
-    lines = lines[pivot:]
+    if not args.keep_input:
+        for f in infiles: rm_if_exists(f)
 
-    cctx = zstandard.ZstdCompressor(level=3, threads=8)
-    compressor = cctx.stream_writer(fout)
-    print('writing')
-    for line in tqdm(lines): compressor.write(line)
-    compressor.flush(zstandard.FLUSH_FRAME)
 
-    cctx = zstandard.ZstdCompressor(level=3, threads=8)
-    compressor = cctx.stream_writer(fouth)
-    print('writing holdout')
-    for line in tqdm(holdout): compressor.write(line)
-    compressor.flush(zstandard.FLUSH_FRAME)
+if __name__ == '__main__':
+    os.makedirs(args.output, exist_ok=True)
+    os.makedirs(args.holdout, exist_ok=True)
 
-    del lines
-
-rm_if_exists(f)
\ No newline at end of file
+    chunks = ls(args.input)
+    with mp.Pool(args.workers) as pool:
+        for _ in tqdm(pool.imap_unordered(process_chunk, chunks), total=len(chunks)):
+            pass
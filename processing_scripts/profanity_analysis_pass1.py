@@ -2,97 +2,35 @@ import lm_dataformat as lmd
 from glob import glob
 import os
 import json
-import collections
+import argparse
 from tqdm import tqdm
 
-import re
 from best_download import download_file
 import fasttext
 
-import zstandard
 import multiprocessing as mp
 from profanity_check import predict
 
-in_path = 'pile'
-out_path = 'prof_analysis'
-
-# From https://stackoverflow.com/a/31505798
-import re
-alphabets= "([A-Za-z])"
-prefixes = "(Mr|St|Mrs|Ms|Dr)[.]"
-suffixes = "(Inc|Ltd|Jr|Sr|Co)"
-starters = "(Mr|Mrs|Ms|Dr|He\s|She\s|It\s|They\s|Their\s|Our\s|We\s|But\s|However\s|That\s|This\s|Wherever)"
-acronyms = "([A-Z][.][A-Z][.](?:[A-Z][.])?)"
-websites = "[.](com|net|org|io|gov)"
-
-def split_into_sentences(text):
-    text = " " + text + "  "
-    text = text.replace("\n"," ")
-    text = re.sub(prefixes,"\\1<prd>",text)
-    text = re.sub(websites,"<prd>\\1",text)
-    if "Ph.D" in text: text = text.replace("Ph.D.","Ph<prd>D<prd>")
-    text = re.sub("\s" + alphabets + "[.] "," \\1<prd> ",text)
-    text = re.sub(acronyms+" "+starters,"\\1<stop> \\2",text)
-    text = re.sub(alphabets + "[.]" + alphabets + "[.]" + alphabets + "[.]","\\1<prd>\\2<prd>\\3<prd>",text)
-    text = re.sub(alphabets + "[.]" + alphabets + "[.]","\\1<prd>\\2<prd>",text)
-    text = re.sub(" "+suffixes+"[.] "+starters," \\1<stop> \\2",text)
-    text = re.sub(" "+suffixes+"[.]"," \\1<prd>",text)
-    text = re.sub(" " + alphabets + "[.]"," \\1<prd>",text)
-    if "”" in text: text = text.replace(".”","”.")
-    if "\"" in text: text = text.replace(".\"","\".")
-    if "!" in text: text = text.replace("!\"","\"!")
-    if "?" in text: text = text.replace("?\"","\"?")
-    text = text.replace(".",".<stop>")
-    text = text.replace("?","?<stop>")
-    text = text.replace("!","!<stop>")
-    text = text.replace("<prd>",".")
-
-    # return quotes to normal
-    text = text.replace("\".", ".\"")
-    text = text.replace("”.", ".”")
-    text = text.replace("\"!", "!\"")
-    text = text.replace("”!", "!”")
-    text = text.replace("\"?", "?\"")
-    text = text.replace("”?", "?”")
-    sentences = text.split("<stop>")
-    sentences = sentences[:-1]
-    sentences = [s.strip() for s in sentences]
-    return sentences
+from the_pile.profanity import sentence_profanity
+from the_pile.utils import batched, writef
 
-from best_download import download_file
-import fasttext
-download_file('https://dl.fbaipublicfiles.com/fasttext/supervised-models/lid.176.bin', 'lid.176.bin', '7e69ec5451bc261cc7844e49e4792a85d7f09c06789ec800fc4a44aec362764e')
-
-langdet = fasttext.load_model("lid.176.bin")
-
-def language(doc):
-    details = langdet.predict(doc.replace('\n', ' '), k=1)
 
-    return {
-        'lang': details[0][0].replace('__label__', '')
-    }
+parser = argparse.ArgumentParser(description='Per-sentence and per-word profanity analysis, pass 1.')
+parser.add_argument('--in_path', type=str, default='pile')
+parser.add_argument('--out_path', type=str, default='prof_analysis')
+parser.add_argument('--workers', type=int, default=24)
+parser.add_argument('--batch_size', type=int, default=512)
+args = parser.parse_args()
 
-def is_english(doc): return doc != '' and language(doc) == 'en'
 
-def words(sent): return re.split(r'\s+', sent)
+def init_process():
+    global langdet
+    langdet = fasttext.load_model("lid.176.bin")
 
-def join(arr):
-    ret = []
-    for val in arr:
-        ret.extend(val)
-       
-    return ret
 
-def unjoin(arr, lens):
-    ret = []
-    
-    last = 0
-    for l in lens:
-        ret.append(arr[last:last+l])
-        last += l
-    assert last == len(arr)
-    
-    return ret
+def languages(sents):
+    labels, _ = langdet.predict([sent.replace('\n', ' ') for sent in sents], k=1)
+    return [label[0].replace('__label__', '') for label in labels]
 
 
 def is_profane(docs):
@@ -100,55 +38,34 @@ def is_profane(docs):
     return list(map(int, predict(docs)))
 
 
-def profanity(doc):
-    sents = list(filter(is_english, split_into_sentences(doc)))
-    p_sents = is_profane(sents)
-    
-    sentwords = list(map(words, sents))
-    sentlens = list(map(len, sentwords))
-    
-    lwords = join(sentwords)
-    p_words = list(map(is_profane, lwords))
-    p_words = unjoin(p_words, sentlens)
-    n_prof = list(map(sum, p_words))
-    
-    res = list(zip(pred, sentlens, n_prof))
-    return {
-        'sentences': res,
-        'num_bytes': len(doc.encode('utf-8'))
-        }    
-
-def writef(f, lines):
-    with open(f, 'wb') as fh:
-        cctx = zstandard.ZstdCompressor(level=3, threads=8)
-        compressor = cctx.stream_writer(fh)
-        for line in tqdm(lines):
-            compressor.write(line)
-        compressor.flush(zstandard.FLUSH_FRAME)
-
-
-def analyze(ob):
-    doc, meta = ob
-    res = {
-        'pile_set_name': meta['pile_set_name']
-    }
+def profanity(docs):
+    return sentence_profanity(docs, languages, is_profane)
+
+
+def analyze(batch):
+    docs = [doc for doc, _ in batch]
+    res = [{'pile_set_name': meta['pile_set_name']} for _, meta in batch]
     for metric in metrics:
-        res = {**res, **metric(doc)}
-    return json.dumps(res).encode('utf-8')
+        res = [{**r, **m} for r, m in zip(res, metric(docs))]
+    return b''.join(json.dumps(r).encode('utf-8') + b'\n' for r in res)
 
 
 metrics = [
     profanity
 ]
 
-pool = mp.Pool(24)
 
+if __name__ == '__main__':
+    download_file('https://dl.fbaipublicfiles.com/fasttext/supervised-models/lid.176.bin', 'lid.176.bin', '7e69ec5451bc261cc7844e49e4792a85d7f09c06789ec800fc4a44aec362764e')
+    os.makedirs(args.out_path, exist_ok=True)
+
+    pool = mp.Pool(args.workers, initializer=init_process)
+
+    for f in tqdm(sorted(glob(args.in_path + '/*'))):
+        if os.path.exists(args.out_path + '/analysis_' + f.split('/')[-1]): continue
+        def meta_items():
+            rdr = lmd.Reader(f)
+            return pool.imap(analyze, batched(rdr.stream_data(get_meta=True), args.batch_size))
 
-for f in tqdm(sorted(glob(in_path + '/*'))):
-    if os.path.exists(out_path + '/analysis_' + f.split('/')[-1]): continue
-    def meta_items():
-        rdr = lmd.Reader(f)
-        return pool.imap(analyze, rdr.stream_data(get_meta=True))
-    
-    writef(out_path + '/tmp_analysis_' + f.split('/')[-1], meta_items())
-    os.rename(out_path + '/tmp_analysis_' + f.split('/')[-1], out_path + '/analysis_' + f.split('/')[-1])
\ No newline at end of file
+        writef(args.out_path + '/tmp_analysis_' + f.split('/')[-1], tqdm(meta_items()))
+        os.rename(args.out_path + '/tmp_analysis_' + f.split('/')[-1], args.out_path + '/analysis_' + f.split('/')[-1])
@@ -0,0 +1,59 @@
+from the_pile.archive import Archive, ArchiveProcess
+import lm_dataformat as lmd
+
+
+def write_docs(ar, docs):
+    for doc in docs:
+        ar.add_data(doc, {'i': doc})
+
+
+def test_resume_matches_uninterrupted(tmp_path):
+    docs = ['doc {}'.format(i) * (i % 5 + 1) for i in range(1000)]
+
+    ar = Archive(str(tmp_path / 'full'))
+    write_docs(ar, docs[:400])
+    ar.checkpoint()
+    write_docs(ar, docs[400:])
+    ar.commit()
+
+    ar = Archive(str(tmp_path / 'resumed'))
+    write_docs(ar, docs[:400])
+    state = ar.checkpoint()
+    # documents written after the checkpoint are lost in the "crash"
+    write_docs(ar, docs[400:600])
+    ar.commit()
+
+    ar = Archive(str(tmp_path / 'resumed'), state=state)
+    write_docs(ar, docs[400:])
+    ar.commit()
+
+    full, = (tmp_path / 'full').glob('data_*')
+    resumed, = (tmp_path / 'resumed').glob('data_*')
+    assert full.read_bytes() == resumed.read_bytes()
+    assert [doc for doc in lmd.Reader(str(resumed)).stream_data()] == docs
+
+
+def test_archive_process_matches_archive(tmp_path):
+    docs = ['doc {}'.format(i) * (i % 5 + 1) for i in range(1000)]
+
+    ar = Archive(str(tmp_path / 'serial'))
+    write_docs(ar, docs[:400])
+    ar.checkpoint()
+    write_docs(ar, docs[400:])
+    ar.commit()
+    ar.close()
+
+    ar = ArchiveProcess(str(tmp_path / 'parallel'), batch_size=7)
+    write_docs(ar, docs[:400])
+    state = ar.checkpoint()
+    write_docs(ar, docs[400:600])
+    ar.close()
+
+    ar = ArchiveProcess(str(tmp_path / 'parallel'), state=state)
+    write_docs(ar, docs[400:])
+    ar.commit()
+    ar.close()
+
+    serial, = (tmp_path / 'serial').glob('*')
+    parallel, = (tmp_path / 'parallel').glob('*')
+    assert serial.read_bytes() == parallel.read_bytes()
@@ -0,0 +1,47 @@
+from the_pile.utils import sha256sum, sha256sum_many
+import hashlib
+import json
+import os
+
+import pytest
+
+
+def test_sidecar_cache(tmp_path):
+    fname = str(tmp_path / 'data')
+    with open(fname, 'wb') as fh:
+        fh.write(os.urandom(5 * 1024 * 1024))
+    os.utime(fname, ns=(10 ** 18, 10 ** 18))
+    real = hashlib.sha256(open(fname, 'rb').read()).hexdigest()
+
+    assert sha256sum(fname) == real
+    sidecar = json.load(open(fname + '.sha256'))
+    assert sidecar['sha256'] == real
+
+    # a hit as long as size and mtime match, so a doctored sidecar is believed
+    json.dump({**sidecar, 'sha256': 'cached'}, open(fname + '.sha256', 'w'))
+    assert sha256sum(fname) == 'cached'
+    assert sha256sum(fname, cache=False) == real
+
+    # same size, new mtime
+    os.utime(fname, ns=(2 * 10 ** 18, 2 * 10 ** 18))
+    assert sha256sum(fname) == real
+
+    json.dump({**json.load(open(fname + '.sha256')), 'sha256': 'cached'}, open(fname + '.sha256', 'w'))
+    with open(fname, 'ab') as fh:
+        fh.write(b'more')
+    os.utime(fname, ns=(2 * 10 ** 18, 2 * 10 ** 18))
+    assert sha256sum(fname) == hashlib.sha256(open(fname, 'rb').read()).hexdigest()
+
+
+def test_verify_many_names_mismatches(tmp_path):
+    files = []
+    for i in range(4):
+        fname = str(tmp_path / 'f{}'.format(i))
+        with open(fname, 'wb') as fh:
+            fh.write(b'file %d' % i)
+        files.append((fname, hashlib.sha256(b'file %d' % i).hexdigest()))
+    sha256sum_many(files, threads=2)
+
+    files[2] = (files[2][0], '0' * 64)
+    with pytest.raises(AssertionError, match='f2'):
+        sha256sum_many(files, threads=2)
@@ -0,0 +1,23 @@
+from the_pile.columns import write_columns, read_columns
+import os
+
+
+def test_columns_round_trip(tmp_path):
+    batches = [
+        {'len_char': [3, 10 ** 12], 'pile_set_name': ['Enron Emails', 'ArXiv'], 'lang': ['en', 'en']},
+        {'len_char': [0], 'pile_set_name': ['Enron Emails'], 'lang': ['de']},
+    ]
+    outdir = str(tmp_path / 'analysis_00.jsonl.zst')
+    write_columns(outdir, iter(batches), ['len_char'], ['pile_set_name', 'lang'])
+    assert not os.path.exists(outdir + '.tmp')
+
+    cols, dictionary = read_columns(outdir, ['len_char', 'pile_set_name', 'lang'])
+    assert cols['len_char'].tolist() == [3, 10 ** 12, 0]
+    assert [dictionary['pile_set_name'][i] for i in cols['pile_set_name']] == ['Enron Emails', 'ArXiv', 'Enron Emails']
+    assert [dictionary['lang'][i] for i in cols['lang']] == ['en', 'en', 'de']
+
+    empty = str(tmp_path / 'analysis_01.jsonl.zst')
+    write_columns(empty, iter([]), ['len_char'], ['lang'])
+    cols, dictionary = read_columns(empty, ['len_char', 'lang'])
+    assert len(cols['len_char']) == len(cols['lang']) == 0
+    assert dictionary == {'lang': []}
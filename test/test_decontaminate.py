@@ -0,0 +1,14 @@
+from the_pile.decontaminate import build_excludes, process_doc
+
+
+def test_cuts_excluded_ngrams():
+    filler = ' '.join('filler{}'.format(i) for i in range(200))
+    leaked = ' '.join('eval{}'.format(i) for i in range(20))
+    excludes = build_excludes([leaked + ' end'])
+
+    assert process_doc(filler, excludes) == [filler]
+
+    pieces = process_doc(filler + ' ' + leaked.upper() + '\n\n' + filler, excludes)
+    assert len(pieces) == 2
+    assert not any('eval' in piece for piece in pieces)
+    assert pieces[0] == filler[:len(pieces[0])]
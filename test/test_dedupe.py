@@ -0,0 +1,21 @@
+from the_pile.dedupe import build_index, load_index, contains, digests
+from the_pile.utils import writef
+import numpy as np
+
+
+def test_index_membership(tmp_path):
+    holdout = [b'{"text": "held out %d"}\n' % i for i in range(1000)]
+    files = [str(tmp_path / 'holdout_{}.jsonl.zst'.format(i)) for i in range(2)]
+    writef(files[0], holdout[:600])
+    # a duplicate inside the holdout itself is stored once
+    writef(files[1], holdout[600:] + holdout[:1])
+
+    build_index(files, str(tmp_path / 'index.npy'), batch_size=128)
+    index = load_index(str(tmp_path / 'index.npy'))
+    assert len(index) == 1000
+    assert np.all(index[1:] > index[:-1])
+
+    train = [b'{"text": "train %d"}\n' % i for i in range(500)] + holdout[::7]
+    seen = contains(index, digests(train))
+    assert seen.tolist() == [False] * 500 + [True] * len(holdout[::7])
+    assert not contains(np.zeros(0, dtype='<u8'), digests(train)).any()
@@ -0,0 +1,201 @@
+import os
+import re
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from the_pile.downloader import fetch, DownloadError
+
+
+DATA = os.urandom(3 * 1024 * 1024 + 123)
+CHECKSUM = hashlib.sha256(DATA).hexdigest()
+
+
+def make_handler(data, fail_after=None, ranges=True):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            if ranges:
+                self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+
+        def do_GET(self):
+            m = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+            if m and ranges:
+                start, end = int(m.group(1)), int(m.group(2)) + 1
+                self.send_response(206)
+            else:
+                start, end = 0, len(data)
+                self.send_response(200)
+            self.send_header('Content-Length', str(end - start))
+            self.end_headers()
+
+            body = data[start:end]
+            if fail_after is not None:
+                # a mirror that drops the connection partway through
+                body = body[:fail_after]
+            self.wfile.write(body)
+
+    return Handler
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(handler):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return 'http://127.0.0.1:{}/file'.format(server.server_address[1])
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def test_parallel_ranges(tmp_path, serve):
+    fname = str(tmp_path / 'file')
+    fetch(fname, CHECKSUM, [serve(make_handler(DATA))], num_ranges=4)
+
+    assert open(fname, 'rb').read() == DATA
+    assert not os.path.exists(fname + '.part')
+    assert not os.path.exists(fname + '.part.json')
+
+
+def test_failover_mid_range(tmp_path, serve):
+    fname = str(tmp_path / 'file')
+    flaky = serve(make_handler(DATA, fail_after=1000))
+    good = serve(make_handler(DATA))
+    fetch(fname, CHECKSUM, [flaky, good], num_ranges=4)
+
+    assert open(fname, 'rb').read() == DATA
+
+
+def test_resume(tmp_path, serve):
+    fname = str(tmp_path / 'file')
+    flaky = serve(make_handler(DATA, fail_after=1000))
+
+    with pytest.raises(DownloadError):
+        fetch(fname, CHECKSUM, [flaky], num_ranges=2, retries=1)
+    assert os.path.exists(fname + '.part.json')
+
+    # everything already fetched is kept, so a server that only serves the rest of each range is enough
+    served = []
+    class Recording(make_handler(DATA)):
+        def do_GET(self):
+            served.append(self.headers['Range'])
+            super().do_GET()
+    fetch(fname, CHECKSUM, [serve(Recording)], num_ranges=2)
+
+    assert open(fname, 'rb').read() == DATA
+    assert all(not r.startswith('bytes=0-') for r in served)
+
+
+def test_no_ranges(tmp_path, serve):
+    fname = str(tmp_path / 'file')
+    fetch(fname, CHECKSUM, [serve(make_handler(DATA, ranges=False))])
+
+    assert open(fname, 'rb').read() == DATA
+
+
+def test_bad_checksum(tmp_path, serve):
+    fname = str(tmp_path / 'file')
+    with pytest.raises(AssertionError):
+        fetch(fname, '0' * 64, [serve(make_handler(DATA))])
+    assert not os.path.exists(fname)
+    assert not os.path.exists(fname + '.part')
+
+
+def make_tar():
+    import io
+    import tarfile
+    import zstandard
+
+    cctx = zstandard.ZstdCompressor()
+    # two frames, like an lmd archive that was committed twice
+    jsonl = cctx.compress(b'{"text": "a"}\n{"text": "b"}\n') + cctx.compress(b'{"text": "c"}\n')
+
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tf:
+        for name, data in [('out/docs.jsonl.zst', jsonl), ('out/books/1.txt', b'hello')]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def test_fetch_and_extract(tmp_path, serve):
+    from the_pile.downloader import fetch_and_extract
+    import json
+
+    data = make_tar()
+    fname = str(tmp_path / 'out.tar.gz')
+    fetch_and_extract(fname, hashlib.sha256(data).hexdigest(), [serve(make_handler(data))])
+
+    assert not os.path.exists(fname)
+    assert open(str(tmp_path / 'out/books/1.txt'), 'rb').read() == b'hello'
+
+    members = {m['name']: m for m in json.load(open(fname + '.members.json'))}
+    assert members['out/docs.jsonl.zst']['num_docs'] == 3
+    assert members['out/books/1.txt']['sha256'] == hashlib.sha256(b'hello').hexdigest()
+
+
+def test_fetch_and_extract_bad_checksum_cleans_up(tmp_path, serve):
+    from the_pile.downloader import fetch_and_extract
+
+    data = make_tar()
+    fname = str(tmp_path / 'out.tar.gz')
+    with pytest.raises(AssertionError):
+        fetch_and_extract(fname, '0' * 64, [serve(make_handler(data))])
+
+    assert not os.path.exists(str(tmp_path / 'out/books/1.txt'))
+
+
+def test_failed_range_stops_the_others(tmp_path, serve):
+    import time
+
+    class Handler(make_handler(DATA)):
+        def do_GET(self):
+            if self.headers['Range'].startswith('bytes=0-'):
+                self.send_error(500)
+                return
+            # every other range trickles in
+            self.send_response(206)
+            self.end_headers()
+            try:
+                for _ in range(100):
+                    self.wfile.write(b'x' * 1000)
+                    self.wfile.flush()
+                    time.sleep(0.1)
+            except OSError:
+                pass
+
+    fname = str(tmp_path / 'file')
+    start = time.time()
+    with pytest.raises(DownloadError):
+        fetch(fname, CHECKSUM, [serve(Handler)], num_ranges=4, retries=1, save_every=0.1)
+    assert time.time() - start < 5
+
+
+def test_verify_extracted_members(tmp_path, serve):
+    from the_pile.downloader import fetch_and_extract
+    from the_pile.utils import verify_downloads
+
+    data = make_tar()
+    fname = str(tmp_path / 'out.tar.gz')
+    fetch_and_extract(fname, hashlib.sha256(data).hexdigest(), [serve(make_handler(data))])
+
+    verify_downloads(str(tmp_path))
+    assert not os.path.exists(str(tmp_path / 'out/books/1.txt.sha256'))
+
+    with open(str(tmp_path / 'out/books/1.txt'), 'wb') as fh:
+        fh.write(b'jello')
+    with pytest.raises(AssertionError):
+        verify_downloads(str(tmp_path))
@@ -0,0 +1,106 @@
+from the_pile.index import DocumentIndex, _RecordWriter, _doc_dtype
+import numpy as np
+
+
+def test_random_access(tmp_path):
+    docs = [('doc {} '.format(i) * (i % 100 + 1), {'i': i}) for i in range(5000)]
+    index = DocumentIndex.build(iter(docs), str(tmp_path / 'index'), frame_size=4096)
+
+    assert len(index) == len(docs)
+    assert len(index.frames) > 100
+    for i in [0, 1, 2500, 4999, 17]:
+        assert index.get(i) == docs[i]
+    assert list(index.doc_lengths()) == [len(doc) for doc, _ in docs]
+
+    sample = index.sample(50, seed=1)
+    assert sample == sorted(sample, key=lambda x: x[1]['i'])
+    assert sample == index.sample(50, seed=1)
+
+
+def test_epochs(tmp_path):
+    import itertools
+
+    docs = [('doc {} '.format(i) * (i % 100 + 1), {'i': i}) for i in range(2000)]
+    index = DocumentIndex.build(iter(docs), str(tmp_path / 'index'), frame_size=4096)
+
+    start, end = 300, 1700
+    n = end - start
+    stream = [meta['i'] for _, meta in itertools.islice(index.epochs(start, end, seed=1), 3 * n)]
+
+    # every epoch is a permutation of the range, shuffled differently each time
+    epochs = [stream[e * n:(e + 1) * n] for e in range(3)]
+    for epoch in epochs:
+        assert sorted(epoch) == list(range(start, end))
+    assert epochs[0] != epochs[1] != epochs[2]
+
+    # resuming from an offset, including one past the first epoch, continues the same stream
+    for offset in [1, 777, n, n + 5]:
+        resumed = [meta['i'] for _, meta in itertools.islice(index.epochs(start, end, seed=1, offset=offset), 100)]
+        assert resumed == stream[offset:offset + 100]
+
+
+def test_documents_range(tmp_path):
+    docs = [('doc {} '.format(i) * (i % 100 + 1), {'i': i}) for i in range(2000)]
+    index = DocumentIndex.build(iter(docs), str(tmp_path / 'index'), frame_size=4096)
+
+    read = []
+    read_frame = index._read_frame
+    index._read_frame = lambda f, dctx=None: read.append(f) or read_frame(f, dctx)
+
+    assert list(index.documents(1234, 1700)) == docs[1234:1700]
+    # only the frames holding the range are decompressed
+    assert read == list(range(index.docs['frame'][1234], index.docs['frame'][1699] + 1))
+    assert list(index.documents(1990)) == docs[1990:]
+
+
+def write_frames(fname, frames):
+    import zstandard
+
+    with open(fname, 'wb') as fh:
+        for frame in frames:
+            # streamed, so the frames don't record their size, like lm_dataformat's
+            writer = zstandard.ZstdCompressor().stream_writer(fh, closefd=False)
+            writer.write(frame)
+            writer.flush(zstandard.FLUSH_FRAME)
+
+
+def test_build_in_place(tmp_path):
+    import json
+    import os
+
+    docs = [('doc {} '.format(i) * (i % 100 + 1), {'i': i}) for i in range(1000)]
+    lines = [json.dumps({'text': doc, 'meta': meta}).encode('utf-8') + b'\n' for doc, meta in docs]
+    source = str(tmp_path / 'source.jsonl.zst')
+    write_frames(source, [b''.join(lines[i:i + 37]) for i in range(0, len(lines), 37)])
+
+    index = DocumentIndex.build_in_place(source, str(tmp_path / 'index'))
+    assert not os.path.exists(str(tmp_path / 'index' / 'docs.jsonl.zst'))
+    assert len(index.frames) == 28 + 1
+    assert list(index.documents()) == docs
+    assert index.get(555) == docs[555]
+    assert list(index.doc_lengths()) == [len(doc) for doc, _ in docs]
+
+    # a frame that splits a line, or one that's too big, can't be indexed in place
+    write_frames(source, [b''.join(lines)[:1000], b''.join(lines)[1000:]])
+    assert DocumentIndex.build_in_place(source, str(tmp_path / 'index2')) is None
+    write_frames(source, [b''.join(lines)])
+    assert DocumentIndex.build_in_place(source, str(tmp_path / 'index2'), max_frame_size=4096) is None
+    assert not os.path.exists(str(tmp_path / 'index2'))
+    assert not os.path.exists(str(tmp_path / 'index2.tmp'))
+
+
+def test_record_writer_streams_chunks(tmp_path):
+    import os
+
+    records = [(i // 10, i * 3, i % 7) for i in range(1000)]
+    for n in [0, 1, 99, 100, 1000]:
+        path = str(tmp_path / 'docs_{}.npy'.format(n))
+        writer = _RecordWriter(path, _doc_dtype, chunk_size=100)
+        for record in records[:n]:
+            writer.append(record)
+        writer.close()
+
+        got = np.load(path, mmap_mode='r')
+        assert got.dtype == _doc_dtype
+        assert got.tolist() == records[:n]
+        assert not os.path.exists(path + '.raw')
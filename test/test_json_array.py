@@ -0,0 +1,25 @@
+import io
+import json
+import random
+
+import pytest
+
+from the_pile.utils import iter_json_array
+
+
+def test_iter_json_array_matches_json_load():
+    rnd = random.Random(42)
+    values = ['a' * 50, 'é"\\\n', 12345, 1.5e10, -0.25, None, True, {'x': [1, 2]}, [], '']
+
+    for _ in range(500):
+        ob = [rnd.choice(values) for _ in range(rnd.randint(0, 30))]
+        s = json.dumps(ob, indent=rnd.choice([None, 1]))
+        # tiny buffers so elements, numbers and whitespace get split across reads
+        assert list(iter_json_array(io.StringIO(s), bufsize=rnd.randint(1, 20))) == ob
+
+
+def test_iter_json_array_rejects_bad_input():
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('{"a": 1}')))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('[1, 2')))
@@ -0,0 +1,49 @@
+from the_pile.datasets import Dataset
+from the_pile.manifest import load_manifest
+import os
+
+
+class Files(Dataset):
+    """ One document per file under src. """
+
+    def __init__(self):
+        self.passes = 0
+
+    def name(self):
+        return 'files'
+
+    def documents(self):
+        self.passes += 1
+        for f in sorted(os.listdir('src')):
+            with open('src/' + f) as fh:
+                yield fh.read(), {}
+
+    def clean(self):
+        pass
+
+    def source_paths(self):
+        return ['src']
+
+
+def test_manifest_cached_until_sources_change(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('src')
+    for i in range(3):
+        with open('src/{}.txt'.format(i), 'w') as fh:
+            fh.write('x' * (10 ** i))
+
+    dataset = Files()
+    assert (dataset.size(), dataset.num_docs()) == (111, 3)
+    assert dataset.manifest()['length_histogram'] == {'1': 1, '4': 1, '7': 1}
+
+    # a fresh instance reads the saved manifest instead of the documents
+    dataset = Files()
+    assert dataset.num_docs() == 3
+    assert dataset.passes == 0
+
+    with open('src/3.txt', 'w') as fh:
+        fh.write('y')
+    assert load_manifest(dataset) is None
+    dataset = Files()
+    assert (dataset.size(), dataset.num_docs()) == (112, 4)
+    assert dataset.passes == 1
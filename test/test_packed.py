@@ -0,0 +1,19 @@
+from the_pile.packed import packed_documents, read_packed, pack_path
+from the_pile.utils import ls, fread
+import os
+
+
+def test_packed_matches_directory(tmp_path):
+    d = str(tmp_path / 'books')
+    os.makedirs(d)
+    for i in range(50):
+        with open(os.path.join(d, 'book{}.txt'.format(i)), 'w') as fh:
+            fh.write('Kapitel {} – naïve\n'.format(i) * (i * 37 % 200))
+
+    expected = list(map(fread, ls(d)))
+    assert '' in expected
+
+    assert list(packed_documents(d)) == expected
+    assert os.path.exists(pack_path(d))
+    # read from the pack in small batches, once it exists
+    assert list(read_packed(pack_path(d), threads=3, batch_size=7)) == expected
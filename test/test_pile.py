@@ -0,0 +1,89 @@
+from the_pile.pile import PileReplication
+from the_pile.datasets import Dataset
+from the_pile.utils import prefetch_documents, cycle_documents, cycle_shard_documents
+import itertools
+import json
+import pytest
+
+
+class FakeDataset(Dataset):
+    def __init__(self, name, n, doc_len):
+        self._name = name
+        self.n = n
+        self.doc_len = doc_len
+
+    def name(self):
+        return self._name
+
+    def documents(self):
+        for i in range(self.n):
+            yield '{} {} '.format(self._name, i) * self.doc_len, {'i': i}
+
+    def clean(self):
+        pass
+
+    def size(self):
+        return self.n * self.doc_len * 10
+
+    def num_docs(self):
+        return self.n
+
+
+def fake_datasets():
+    return [(FakeDataset('small', 500, 2), 1.), (FakeDataset('books', 40, 5000), 2.)]
+
+
+def ids(pile, n):
+    return [(meta['pile_set_name'], meta['i']) for _, meta in itertools.islice(pile.documents(), n)]
+
+
+def test_prefetch_matches_serial():
+    serial = ids(PileReplication(fake_datasets(), 10 ** 9), 3000)
+    prefetched = ids(PileReplication(fake_datasets(), 10 ** 9, prefetch=True), 3000)
+
+    assert prefetched == serial
+    assert {name for name, _ in serial} == {'small', 'books'}
+
+
+def test_prefetch_batches_by_bytes():
+    dataset = FakeDataset('books', 40, 5000)
+    # a couple of documents per batch, cycling through the dataset a few times
+    prefetched = list(itertools.islice(prefetch_documents(dataset, batch_bytes=100000, queue_size=2), 150))
+    assert prefetched == list(itertools.islice(cycle_documents(dataset), 150))
+
+
+def test_shards_split_the_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dataset = FakeDataset('small', 500, 2)
+
+    shards = [[meta['i'] for _, meta in itertools.islice(cycle_shard_documents(dataset, i, 3), 400)] for i in range(3)]
+    # each shard cycles through its own third
+    assert shards[0][:167] == list(range(166)) + [0]
+    assert shards[1][:168] == list(range(166, 333)) + [166]
+    assert shards[2][:167] == list(range(333, 500))
+
+    with pytest.raises(ValueError):
+        cycle_shard_documents(FakeDataset('tiny', 2, 1), 0, 3)
+
+
+def test_resume_seeks_in_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dataset = FakeDataset('small', 500, 2)
+    full = list(itertools.islice(cycle_shard_documents(dataset, 0, 1), 1500))
+
+    for offset in [1, 499, 500, 1234]:
+        assert list(itertools.islice(cycle_shard_documents(dataset, 0, 1, offset), 200)) == full[offset:offset + 200]
+
+
+def test_checkpoint_round_trip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for kwargs in [{}, {'byte_schedule': True}]:
+        pile = PileReplication(fake_datasets(), 10 ** 9, **kwargs)
+        docs = pile.documents()
+        list(itertools.islice(docs, 1200))
+        state = json.loads(json.dumps(pile.state()))
+        rest = [meta for _, meta in itertools.islice(docs, 1000)]
+
+        resumed = PileReplication(fake_datasets(), 10 ** 9, **kwargs)
+        resumed.restore(state)
+        assert [meta for _, meta in itertools.islice(resumed.documents(), 1000)] == rest
@@ -0,0 +1,46 @@
+import json
+import itertools
+
+from the_pile.pile_reader import PileReader
+from the_pile.utils import writef
+
+
+def make_shards(tmp_path, sizes=(700, 50, 300, 0, 1000), doc_len=1):
+    files = []
+    expected = []
+    for i, n in enumerate(sizes):
+        docs = [' '.join(['shard {} doc {}'.format(i, j)] * doc_len) for j in range(n)]
+        f = str(tmp_path / '{}.jsonl.zst'.format(i))
+        # one document has its text split into paragraphs
+        writef(f, [json.dumps({'text': doc.split(' ') if j == 1 else doc, 'meta': {}}).encode('utf-8') + b'\n' for j, doc in enumerate(docs)])
+        files.append(f)
+        expected.extend(doc if j != 1 else '\n\n'.join(doc.split(' ')) for j, doc in enumerate(docs))
+    return files, expected
+
+
+def texts(reader):
+    return [x['text'] for x in reader]
+
+
+def test_reads_every_shard_in_a_fixed_order(tmp_path):
+    files, expected = make_shards(tmp_path)
+
+    assert texts(PileReader(files, interleave=1)) == expected
+
+    interleaved = texts(PileReader(files, interleave=3, block_size=64))
+    assert sorted(interleaved) == sorted(expected)
+    assert interleaved != expected
+    # the number of workers decoding at once doesn't change the order
+    for num_workers in [1, 2, 8]:
+        assert texts(PileReader(files, interleave=3, num_workers=num_workers, block_size=64)) == interleaved
+    assert texts(PileReader(files, interleave=3, num_workers=2, block_size=64, use_processes=True)) == interleaved
+
+
+def test_stopping_early_shuts_down_workers(tmp_path):
+    # blocks of ~300kB, more than a pipe holds, so process workers have blocks buffered when the reader is closed
+    files, expected = make_shards(tmp_path, sizes=(200, 200, 200), doc_len=1000)
+    for use_processes in [False, True]:
+        reader = iter(PileReader(files, interleave=3, num_workers=2, block_size=16, use_processes=use_processes))
+        assert len(list(itertools.islice(reader, 10))) == 10
+        # closing the generator joins every worker, which would hang if one were stuck handing over a block
+        reader.close()
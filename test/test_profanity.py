@@ -0,0 +1,34 @@
+from the_pile.profanity import sentence_profanity
+
+
+def languages(sents):
+    return ['en' if sent.isascii() else 'de' for sent in sents]
+
+
+def is_profane(texts):
+    return [int('darn' in text) for text in texts]
+
+
+docs = [
+    'Well darn it. That is fine! Das ist schön.',
+    '',
+    'Über alles. Nothing here?',
+    'Darn. darn darn again.',
+]
+
+
+def test_batched_matches_per_document():
+    batched = sentence_profanity(docs, languages, is_profane)
+    assert batched == [sentence_profanity([doc], languages, is_profane)[0] for doc in docs]
+
+
+def test_only_english_sentences():
+    res = sentence_profanity(docs, languages, is_profane)
+
+    assert [r['sentences'] for r in res] == [
+        [(1, 3, 1), (0, 3, 0)],
+        [],
+        [(0, 2, 0)],
+        [(0, 1, 0), (1, 3, 2)],
+    ]
+    assert [r['num_bytes'] for r in res] == [len(doc.encode('utf-8')) for doc in docs]
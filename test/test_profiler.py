@@ -0,0 +1,40 @@
+import csv
+import json
+import queue
+
+from the_pile.profiler import Profiler
+
+
+def test_profiler_metrics(tmp_path):
+    docs = [('doc {}'.format(i), {}) for i in range(100)]
+    q = queue.Queue()
+    q.put(1)
+
+    for fname in ['metrics.json', 'metrics.csv']:
+        profiler = Profiler(True, metrics_file=str(tmp_path / fname), sample_every=2, report_every=50)
+        profiler.watch_queue('q', q)
+        it = iter(docs)
+        for _ in docs:
+            doc, meta = profiler.measured_next('a', it)
+            with profiler.stage('write', 'a', len(doc)):
+                pass
+        profiler.report()
+
+    snapshot = json.loads((tmp_path / 'metrics.json').read_text())
+    stages = {(row['stage'], row['component']): row for row in snapshot['stages']}
+    assert stages['read', 'a']['docs'] == 100
+    assert stages['read', 'a']['bytes'] == sum(len(doc) for doc, _ in docs[1::2]) * 2
+    assert stages['write', 'a']['docs'] == 100
+    assert snapshot['queue_depths'] == {'q': 1}
+
+    rows = list(csv.DictReader(open(str(tmp_path / 'metrics.csv'))))
+    # three reports, each with two stages and a queue
+    assert len(rows) == 9
+
+
+def test_disabled_profiler_is_a_no_op():
+    profiler = Profiler(False)
+    assert profiler.measured_next('a', iter([('x', {})])) == ('x', {})
+    with profiler.stage('write'):
+        pass
+    assert profiler.metrics() == []
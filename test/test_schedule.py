@@ -0,0 +1,44 @@
+import numpy as np
+
+from the_pile.schedule import ByteQuotaScheduler
+
+
+rnd = np.random.RandomState(42)
+MIXED = (rnd.rand(10), rnd.randint(500, 100000, size=10).astype(float))
+# a books-like component with documents 250x the size of the smallest, and one with a small share of huge documents
+SKEWED = ([0.3, 0.2, 0.5], [50000., 2000., 200.])
+VERY_SKEWED = ([0.05, 0.45, 0.5], [200000., 300., 3000.])
+
+
+def chunk_bytes(shares, doc_sizes, size_of, chunks=200):
+    """ Bytes of each component in every chunk, with the size of each document drawn by size_of(component). """
+    scheduler = ByteQuotaScheduler(shares, doc_sizes)
+    for _ in range(chunks):
+        state = scheduler.state()
+        chunk = scheduler.next_chunk()
+        # the same state always gives the same chunk
+        assert np.array_equal(chunk, ByteQuotaScheduler(shares, doc_sizes, state=state).next_chunk())
+
+        got = np.zeros(len(doc_sizes))
+        for component in chunk.tolist():
+            size = size_of(component)
+            scheduler.add(component, size)
+            got[component] += size
+        yield scheduler, got
+
+
+def test_every_chunk_stays_near_byte_shares():
+    # with documents of exactly the expected size, every chunk is within about one of the largest documents of the
+    # target mixture
+    for shares, doc_sizes in [MIXED, SKEWED, VERY_SKEWED]:
+        for scheduler, got in chunk_bytes(shares, doc_sizes, lambda component: doc_sizes[component]):
+            assert np.abs(got / got.sum() - scheduler.shares).max() < 1.5 * max(doc_sizes) / got.sum()
+
+    # with random sizes, every chunk is within a few standard deviations of the noise in its bytes, and over the
+    # whole run the shares are close
+    for shares, doc_sizes in [MIXED, SKEWED]:
+        sizes = np.random.RandomState(0)
+        for scheduler, got in chunk_bytes(shares, doc_sizes, lambda component: int(sizes.exponential(doc_sizes[component])) + 1):
+            sigma = np.sqrt(np.sum(scheduler.shares * scheduler.doc_sizes) / got.sum())
+            assert np.abs(got / got.sum() - scheduler.shares).max() < 4 * sigma
+        assert np.abs(scheduler.emitted / scheduler.emitted.sum() - scheduler.shares).max() < 0.01
@@ -0,0 +1,86 @@
+from the_pile.shards import process_shards, LazyRecord
+from the_pile.utils import readf, writef
+import json
+import ujson
+
+
+def make_shards(tmp_path, n=3):
+    files = []
+    for i in range(n):
+        f = str(tmp_path / 'shard_{}.jsonl.zst'.format(i))
+        writef(f, [json.dumps({'text': 'doc {} {}'.format(i, j), 'meta': {'j': j}}).encode('utf-8') + b'\n' for j in range(10)] + [b'\n'])
+        files.append(f)
+    return files
+
+
+def nonempty(line):
+    return line.strip()
+
+
+def even(doc):
+    text, meta = doc
+    return meta['j'] % 2 == 0
+
+
+def upper(doc):
+    text, meta = doc
+    return text.upper(), meta
+
+
+def test_filter_in_place(tmp_path):
+    files = make_shards(tmp_path)
+    totals = process_shards(nonempty, files, mode='filter', workers=2)
+
+    assert (totals['shards'], totals['in'], totals['out']) == (3, 33, 30)
+    for f in files:
+        assert b'\n' not in list(readf(f))
+        assert len(list(readf(f))) == 10
+
+    # finished shards are skipped when rerun
+    totals = process_shards(nonempty, files, mode='filter', workers=2)
+    assert (totals['shards'], totals['skipped']) == (0, 3)
+
+
+def test_parsed_to_out_dir(tmp_path):
+    files = make_shards(tmp_path)[:2]
+    out = tmp_path / 'out'
+
+    process_shards(nonempty, files, mode='filter', workers=1)
+    process_shards(even, files, out_dir=str(out), mode='filter', parse=True, workers=1)
+    totals = process_shards(upper, [str(out / 'shard_0.jsonl.zst')], parse=True, workers=1)
+
+    assert totals['out'] == 5
+    assert [json.loads(line) for line in readf(str(out / 'shard_0.jsonl.zst'))] == [{'text': 'DOC 0 {}'.format(j), 'meta': {'j': j}} for j in range(0, 10, 2)]
+    # the inputs are untouched
+    assert len(list(readf(files[1]))) == 10
+
+
+def test_lazy_record_meta_without_text():
+    ob = {'text': 'a "meta": {} } b', 'meta': {'pile_set_name': 'X', 'meta': {'nested': 1}}}
+    for line in [ujson.dumps(ob).encode('utf-8') + b'\n', json.dumps({'meta': ob['meta'], 'text': ob['text']}).encode('utf-8')]:
+        rec = LazyRecord(line)
+        assert rec.meta == ob['meta']
+        assert rec.text == ob['text']
+        assert rec.to_bytes() is line
+
+    rec = LazyRecord(ujson.dumps({'text': 'x', 'meta': {'pile_set_name': 'X'}}).encode('utf-8') + b'\n')
+    assert rec.meta['pile_set_name'] == 'X'
+    assert rec._text is None
+
+
+def rename_odd(rec):
+    if rec.meta['j'] % 2:
+        rec.text = 'odd'
+    return rec
+
+
+def test_lazy_rewrite_keeps_untouched_lines(tmp_path):
+    f, = make_shards(tmp_path, 1)
+    process_shards(nonempty, [f], mode='filter', workers=1)
+    before = list(readf(f))
+
+    process_shards(rename_odd, [f], parse='lazy', workers=1)
+    after = list(readf(f))
+
+    assert after[::2] == before[::2]
+    assert [json.loads(line)['text'] for line in after[1::2]] == ['odd'] * 5
@@ -0,0 +1,21 @@
+from the_pile.shuffle import external_shuffle, is_holdout
+
+
+def test_external_shuffle_spills_and_keeps_lines(tmp_path):
+    lines = ['line {}\n'.format(i).encode('utf-8') for i in range(20000)]
+
+    # small enough budget to force lots of runs onto disk
+    shuffled = list(external_shuffle(iter(lines), mem_budget=100000, tmpdir=str(tmp_path)))
+
+    assert shuffled != lines
+    assert sorted(shuffled) == sorted(lines)
+    assert shuffled == list(external_shuffle(iter(lines), mem_budget=10 ** 9))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_holdout_is_stable():
+    lines = ['line {}\n'.format(i).encode('utf-8') for i in range(20000)]
+    holdout = [x for x in lines if is_holdout(x, 0.01)]
+
+    assert 100 < len(holdout) < 300
+    assert holdout == [x for x in lines if is_holdout(x, 0.01)]
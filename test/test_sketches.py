@@ -0,0 +1,35 @@
+import numpy as np
+
+from the_pile.sketches import Moments, LogHistogram, CountMap, Sketches
+
+
+def test_sketches_merge_like_one_pass(tmp_path):
+    rnd = np.random.RandomState(42)
+    xs = rnd.lognormal(6, 2, size=100000)
+    langs = rnd.choice(['en', 'de', 'fr'], size=len(xs))
+
+    shards = []
+    for part, part_langs in zip(np.array_split(xs, 7), np.array_split(langs, 7)):
+        sketches = Sketches()
+        # uneven batches within a shard too
+        for batch in np.array_split(part, 3):
+            sketches.get(('a', 'len'), Moments).update(batch)
+        sketches.get(('a', 'hist'), LogHistogram).update(part)
+        sketches.get(('a', 'lang'), CountMap).update(part_langs)
+        sketches.save(str(tmp_path / 'shard.json'))
+        shards.append(Sketches.load(str(tmp_path / 'shard.json')))
+
+    total = Sketches()
+    for sketches in shards:
+        total.merge(sketches)
+
+    moments = total['a', 'len']
+    assert moments.n == len(xs)
+    assert np.isclose(moments.mean, xs.mean())
+    assert np.isclose(moments.stddev(), xs.std())
+
+    hist = total['a', 'hist']
+    for q in [0.1, 0.5, 0.99]:
+        assert abs(hist.quantile(q) / np.quantile(xs, q) - 1) < 0.1
+
+    assert total['a', 'lang'].counts == {lang: int((langs == lang).sum()) for lang in ['en', 'de', 'fr']}
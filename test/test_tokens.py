@@ -0,0 +1,88 @@
+import numpy as np
+
+from the_pile.tokens import TokenWriter, TokenShard, _sample_documents, _imap_bounded
+from the_pile.datasets import Dataset
+import os
+import multiprocessing as mp
+
+
+def test_token_shards_roundtrip(tmp_path):
+    rnd = np.random.RandomState(42)
+    docs = [(rnd.randint(0, 50257, size=rnd.randint(1, 100)).astype(np.uint16), 'set{}'.format(i % 3)) for i in range(200)]
+
+    writer = TokenWriter(str(tmp_path), shard_tokens=1000)
+    for ids, component in docs:
+        writer.add_tokens(ids, component)
+    writer.close()
+
+    got = []
+    i = 0
+    while (tmp_path / 'tokens_{}.bin'.format(i)).exists():
+        shard = TokenShard(str(tmp_path), i)
+        assert shard.tokens.dtype == np.uint16
+        got.extend((shard[j], shard.component(j)) for j in range(len(shard)))
+        i += 1
+
+    assert i > 1
+    assert len(got) == len(docs)
+    for (ids, component), (ids2, component2) in zip(docs, got):
+        assert component == component2
+        assert np.array_equal(ids, ids2)
+
+
+def test_token_shard_format(tmp_path):
+    import json
+
+    writer = TokenWriter(str(tmp_path), shard_tokens=5)
+    for ids, component in [([1, 2, 3], 'a'), ([70000, 5], 'b'), ([6], 'a'), ([7, 8], 'b')]:
+        writer.add_tokens(np.array(ids, dtype=np.uint32), component)
+    writer.close()
+
+    # shards are cut after the document that reaches shard_tokens
+    assert np.fromfile(str(tmp_path / 'tokens_0.bin'), dtype=np.uint32).tolist() == [1, 2, 3, 70000, 5]
+    assert np.load(str(tmp_path / 'tokens_0.idx.npy')).tolist() == [0, 3, 5]
+    assert np.load(str(tmp_path / 'tokens_0.tags.npy')).tolist() == [0, 1]
+    assert np.fromfile(str(tmp_path / 'tokens_1.bin'), dtype=np.uint32).tolist() == [6, 7, 8]
+    assert np.load(str(tmp_path / 'tokens_1.idx.npy')).tolist() == [0, 1, 3]
+    assert np.load(str(tmp_path / 'tokens_1.tags.npy')).tolist() == [0, 1]
+    assert json.load(open(str(tmp_path / 'components.json'))) == {'components': ['a', 'b'], 'dtype': 'uint32'}
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+class Counting(Dataset):
+    def name(self):
+        return 'counting'
+
+    def documents(self):
+        return (('doc {}'.format(i), {}) for i in range(10 ** 9))
+
+    def clean(self):
+        pass
+
+
+def test_sample_without_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sample = _sample_documents(Counting(), 100, 1000)
+
+    assert len(sample) == 100
+    assert all(int(doc.split()[1]) < 1000 for doc in sample)
+    assert max(int(doc.split()[1]) for doc in sample) >= 500
+    # no index gets built for it
+    assert not os.path.exists('components')
+
+
+def test_imap_bounded_reads_ahead_at_most_max_pending():
+    read = []
+
+    def items():
+        for i in range(100):
+            read.append(i)
+            yield i
+
+    with mp.Pool(2) as pool:
+        got = []
+        for x in _imap_bounded(pool, abs, items(), 4):
+            # never more than 4 items read but not yet consumed
+            assert len(read) <= len(got) + 4
+            got.append(x)
+    assert got == list(range(100))
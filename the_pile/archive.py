@@ -0,0 +1,158 @@
+import os
+import time
+import queue
+import traceback
+import multiprocessing as mp
+import ujson as json
+from glob import glob
+
+import zstandard
+
+
+class Archive:
+    """ Drop-in for lmd.Archive that can checkpoint its incomplete chunk and pick it back up after a restart. """
+
+    def __init__(self, out_dir, compression_level=3, threads=8, state=None):
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        self.i = 0
+        self.cctx = zstandard.ZstdCompressor(level=compression_level, threads=threads)
+
+        if state is None:
+            self.fh = open(self.incomplete_path(), 'wb')
+        else:
+            self._restore(state)
+
+        self.compressor = self.cctx.stream_writer(self.fh)
+
+    def incomplete_path(self):
+        return self.out_dir + '/current_chunk_incomplete'
+
+    def add_data(self, data, meta={}):
+        self.compressor.write(json.dumps({'text': data, 'meta': meta}).encode('UTF-8') + b'\n')
+
+    def commit(self, archive_name='default'):
+        fname = self.out_dir + '/data_' + str(self.i) + '_time' + str(int(time.time())) + '_' + archive_name + '.jsonl.zst'
+        self.compressor.flush(zstandard.FLUSH_FRAME)
+
+        self.fh.flush()
+        self.fh.close()
+        os.rename(self.incomplete_path(), fname)
+        self.fh = open(self.incomplete_path(), 'wb')
+        self.compressor = self.cctx.stream_writer(self.fh)
+
+        self.i += 1
+
+    def checkpoint(self):
+        """ End the current zstd frame and make everything written so far durable. Returns the state to pass back in to resume. """
+        self.compressor.flush(zstandard.FLUSH_FRAME)
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+
+        return {'i': self.i, 'pos': self.fh.tell()}
+
+    def _restore(self, state):
+        self.i = state['i']
+
+        # the chunk that was incomplete at checkpoint time may have been committed since
+        committed = glob(self.out_dir + '/data_{}_time*.jsonl.zst'.format(self.i))
+        if committed:
+            os.replace(committed[0], self.incomplete_path())
+
+        # anything committed after the checkpoint will be regenerated
+        for f in glob(self.out_dir + '/data_*_time*.jsonl.zst'):
+            if int(os.path.basename(f).split('_')[1]) > self.i:
+                os.remove(f)
+
+        self.fh = open(self.incomplete_path(), 'r+b')
+        self.fh.truncate(state['pos'])
+        self.fh.seek(state['pos'])
+
+    def close(self):
+        self.fh.close()
+        if os.path.getsize(self.incomplete_path()) == 0:
+            os.remove(self.incomplete_path())
+
+
+def _archive_worker(args, kwargs, requests, replies):
+    try:
+        ar = Archive(*args, **kwargs)
+        while True:
+            cmd, arg = requests.get()
+            if cmd == 'add':
+                for data, meta in arg:
+                    ar.add_data(data, meta)
+            elif cmd == 'commit':
+                ar.commit(archive_name=arg)
+            elif cmd == 'checkpoint':
+                replies.put(ar.checkpoint())
+            elif cmd == 'close':
+                ar.close()
+                replies.put(None)
+                return
+    except Exception:
+        replies.put(RuntimeError('Archive writer for {} failed:\n{}'.format(args[0], traceback.format_exc())))
+
+
+class ArchiveProcess:
+    """ An Archive in its own process, so serializing and compressing documents happens off the caller's thread.
+
+    Same interface as Archive. Documents are passed over in batches of batch_size, and add_data only blocks once
+    max_pending batches are waiting on the writer. Call close() when done.
+    """
+
+    def __init__(self, out_dir, compression_level=3, threads=8, state=None, batch_size=256, max_pending=64):
+        self.out_dir = out_dir
+        self.batch_size = batch_size
+        self.batch = []
+        self.requests = mp.Queue(max_pending)
+        self.replies = mp.Queue()
+        self.process = mp.Process(target=_archive_worker, args=((out_dir, compression_level, threads, state), {}, self.requests, self.replies), daemon=True)
+        self.process.start()
+
+    def _send(self, cmd, arg=None):
+        while True:
+            try:
+                self.requests.put((cmd, arg), timeout=1)
+                return
+            except queue.Full:
+                # don't wait forever on a writer that has died
+                if not self.process.is_alive():
+                    self._reply()
+
+    def _reply(self):
+        while True:
+            try:
+                reply = self.replies.get(timeout=1)
+                break
+            except queue.Empty:
+                if not self.process.is_alive() and self.replies.empty():
+                    raise RuntimeError('Archive writer for {} exited unexpectedly'.format(self.out_dir))
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def _flush(self):
+        if self.batch:
+            self._send('add', self.batch)
+            self.batch = []
+
+    def add_data(self, data, meta={}):
+        self.batch.append((data, meta))
+        if len(self.batch) >= self.batch_size:
+            self._flush()
+
+    def commit(self, archive_name='default'):
+        self._flush()
+        self._send('commit', archive_name)
+
+    def checkpoint(self):
+        self._flush()
+        self._send('checkpoint')
+        return self._reply()
+
+    def close(self):
+        self._flush()
+        self._send('close')
+        self._reply()
+        self.process.join()
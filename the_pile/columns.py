@@ -0,0 +1,35 @@
+import os
+import json
+import shutil
+
+import numpy as np
+
+
+def write_columns(outdir, batches, int_columns, str_columns):
+    """ Save batches of per-document values (dicts of column name -> list) as one .npy per column in outdir.
+    String columns are stored as uint16 ids into the lists in dictionary.json. outdir only appears once complete. """
+    columns = {name: [] for name in int_columns + str_columns}
+    dictionary = {name: {} for name in str_columns}
+
+    for batch in batches:
+        for name in int_columns:
+            columns[name].append(np.array(batch[name], dtype=np.int64))
+        for name in str_columns:
+            ids = dictionary[name]
+            columns[name].append(np.array([ids.setdefault(v, len(ids)) for v in batch[name]], dtype=np.uint16))
+
+    tmp = outdir + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, arrs in columns.items():
+        np.save(tmp + '/' + name + '.npy', np.concatenate(arrs) if arrs else np.array([], dtype=np.int64))
+    with open(tmp + '/dictionary.json', 'w') as fh:
+        json.dump({name: list(ids) for name, ids in dictionary.items()}, fh)
+    os.rename(tmp, outdir)
+
+
+def read_columns(outdir, names):
+    """ The columns in names, memory-mapped, and the dictionary of string values for the string columns. """
+    with open(outdir + '/dictionary.json') as fh:
+        dictionary = json.load(fh)
+    return {name: np.load(outdir + '/' + name + '.npy', mmap_mode='r') for name in names}, dictionary
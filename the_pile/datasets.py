@@ -7,6 +7,9 @@ import lm_dataformat as lmd
 from tqdm import tqdm
 
 from .utils import *
+from .index import DocumentIndex, index_path
+from .manifest import load_manifest, build_manifest, fingerprint
+from .packed import packed_documents
 
 class Dataset(abc.ABC):
     @abc.abstractmethod
@@ -26,22 +29,70 @@ class Dataset(abc.ABC):
     
     def size(self):
         """ Return an estimate of the dataset size. Implementations may use a faster, less accurate estimate. """
-
-        size = sum(map(utf8len, tqdm(self.documents())))
-        print('size', self.name(), size)
-        return size
+        return self.manifest()['bytes']
     
     def num_docs(self):
         """ Return an estimate of the number of documents in the dataset. Implementations may use a faster, less accurate estimate. """
-
-        size = len(list(map(lambda x: None, tqdm(self.documents()))))
-        print('docs', self.name(), size)
-        return size
+        return self.manifest()['num_docs']
     
     def already_shuffled(self):
         """ Datasets where the source is already shuffled should override this to return True so that it isn't shuffled again. """
         return False
 
+    def source_paths(self):
+        """ Files or directories the documents are read from. Cached manifests and indices are rebuilt when any of them change. """
+        return []
+
+    def manifest(self):
+        """ Size, document count and length histogram of the dataset. Computed in one pass and cached on disk until source_paths() change. """
+        if getattr(self, '_manifest', None) is None:
+            self._manifest = load_manifest(self)
+
+        if self._manifest is None:
+            if self.has_index():
+                lengths = self.index().doc_lengths().tolist()
+            else:
+                lengths = (utf8len(doc) for doc, _ in tqdm(self.documents()))
+            self._manifest = build_manifest(self, lengths)
+            print('manifest', self.name(), self._manifest['bytes'], self._manifest['num_docs'])
+
+        return self._manifest
+
+    def index_source(self):
+        """ The one jsonl.zst file documents() reads as is, if there is one, downloaded if needed. Its frames can
+        then be indexed in place instead of writing a copy of the dataset. """
+        return None
+
+    def has_index(self):
+        return DocumentIndex.exists(index_path(self), fingerprint(self.source_paths()))
+
+    def index(self):
+        """ A DocumentIndex for random access to this dataset. Building it takes one pass over documents() and,
+        unless index_source() is already split into small frames, writes a second compressed copy of the dataset
+        under components/index. """
+        if getattr(self, '_index', None) is None:
+            if not self.has_index():
+                get_fingerprint = lambda: fingerprint(self.source_paths())
+                source = self.index_source()
+                index = DocumentIndex.build_in_place(source, index_path(self), get_fingerprint=get_fingerprint) if source else None
+                if index is None:
+                    print('Building index for', self.name(), '(a re-framed copy under', index_path(self) + ')')
+                    index = DocumentIndex.build(tqdm(self.documents()), index_path(self), get_fingerprint=get_fingerprint)
+                # the manifest falls out of the same pass
+                self._manifest = build_manifest(self, index.doc_lengths().tolist())
+
+            self._index = DocumentIndex(index_path(self))
+
+        return self._index
+
+    def get(self, i):
+        """ The i-th document, with metadata. """
+        return self.index().get(i)
+
+    def sample(self, k, seed=42):
+        """ k distinct documents chosen uniformly at random, in dataset order. """
+        return self.index().sample(k, seed)
+
 
 class WikipediaDataset(Dataset):
     def name(self):
@@ -52,19 +103,39 @@ class WikipediaDataset(Dataset):
             Source('direct', 'http://eaidata.bmk.sh/data/wikipedia-en.tar.gz'),
         ], extract=True)
 
-    def documents(self):
-        self._download()
-
+    def _json_documents(self):
         for file in ls('components/wikipedia_en/output'):
             if not file.endswith('.json'):
                 continue
 
             with open(file) as fh:
-                ob = json.load(fh)
-                yield from dummy_meta(ob)
+                yield from dummy_meta(iter_json_array(fh))
+
+    def to_jsonl_zst(self):
+        """ One-time conversion of the json output files into a single jsonl.zst, which documents() then reads instead. """
+        self._download()
+        out = 'components/wikipedia_en/wikipedia_en.jsonl.zst'
+        writef(out + '.tmp', (json.dumps({'text': doc, 'meta': meta}).encode('utf-8') + b'\n' for doc, meta in tqdm(self._json_documents())))
+        os.rename(out + '.tmp', out)
+
+    def documents(self):
+        self._download()
+
+        if os.path.exists('components/wikipedia_en/wikipedia_en.jsonl.zst'):
+            yield from lmd.Reader('components/wikipedia_en/wikipedia_en.jsonl.zst').stream_data(get_meta=True)
+        else:
+            yield from self._json_documents()
+
+    def index_source(self):
+        self._download()
+        if os.path.exists('components/wikipedia_en/wikipedia_en.jsonl.zst'):
+            return 'components/wikipedia_en/wikipedia_en.jsonl.zst'
 
     def clean(self):
         rm_if_exists('components/wikipedia_en')
+
+    def source_paths(self):
+        return ['components/wikipedia_en']
     
     def size(self):
         return 6847462907
@@ -90,6 +161,9 @@ class OpensubtitlesDataset(Dataset):
     def clean(self):
         rm_if_exists('components/opensubtitles')
 
+    def source_paths(self):
+        return ['components/opensubtitles']
+
 
     def size(self):
         return 13940478112
@@ -111,11 +185,14 @@ class BookCorpusDataset(Dataset):
     def documents(self):
         self._download()
 
-        return dummy_meta(map(fread, ls('components/bookcorpus/books1/epubtxt')))
+        return dummy_meta(packed_documents('components/bookcorpus/books1/epubtxt'))
 
     def clean(self):
         rm_if_exists('components/bookcorpus')
 
+    def source_paths(self):
+        return ['components/bookcorpus']
+
     def size(self):
         return 6767414779
     
@@ -152,6 +229,9 @@ class OpenWebTextDataset(Dataset):
     def clean(self):
         rm_if_exists('components/openwebtext')
 
+    def source_paths(self):
+        return ['components/openwebtext']
+
     
     def size(self):
         return 39757465434
@@ -180,10 +260,13 @@ class GutenbergDataset(Dataset):
     def documents(self):
         self._download()
 
-        return dummy_meta(map(fread, ls('components/gutenberg/pg19_train')))
+        return dummy_meta(packed_documents('components/gutenberg/pg19_train'))
 
     def clean(self):
         rm_if_exists('components/gutenberg')
+
+    def source_paths(self):
+        return ['components/gutenberg']
     
     def size(self):
         return 11678184672
@@ -218,13 +301,16 @@ class DMMathDataset(Dataset):
 
         return dummy_meta(chunk_at_even_lines(concat(
             map(
-                lambda x: map(fread, ls('components/dm_math/mathematics_dataset-v1.0/train-' + x)), 
+                lambda x: packed_documents('components/dm_math/mathematics_dataset-v1.0/train-' + x), 
                 ['easy', 'medium', 'hard'])
         ), 8192))
 
     def clean(self):
         rm_if_exists('components/dm_math')
 
+    def source_paths(self):
+        return ['components/dm_math']
+
     def size(self):
         return 8316165951
     
@@ -246,9 +332,16 @@ class EnronEmailsDataset(Dataset):
 
         return lmd.Reader('components/enron_emails/enron_emails.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/enron_emails/enron_emails.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/enron_emails')
 
+    def source_paths(self):
+        return ['components/enron_emails']
+
     def size(self):
         return 945212874
     
@@ -271,9 +364,16 @@ class LiteroticaDataset(Dataset):
 
         return lmd.Reader('components/literotica/Literotica.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/literotica/Literotica.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/literotica')
 
+    def source_paths(self):
+        return ['components/literotica']
+
     def size(self):
         return 12458318640
     
@@ -295,9 +395,16 @@ class BibliotikDataset(Dataset):
 
         yield from lmd.Reader('components/bibliotik/Bibliotik.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/bibliotik/Bibliotik.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/bibliotik')
 
+    def source_paths(self):
+        return ['components/bibliotik']
+
     def size(self):
         return 108404259563
     
@@ -339,6 +446,9 @@ class CORD19Dataset(Dataset):
 
     def clean(self):
         rm_if_exists('components/cord19')
+
+    def source_paths(self):
+        return ['components/cord19']
     
     def size(self):
         return 4573360967
@@ -361,8 +471,15 @@ class UbuntuIRCDataset(Dataset):
 
         return lmd.Reader('components/ubuntu_irc/ubuntu_irc_weekly.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/ubuntu_irc/ubuntu_irc_weekly.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/ubuntu_irc')
+
+    def source_paths(self):
+        return ['components/ubuntu_irc']
     
     def size(self):
         return 5923631555
@@ -385,9 +502,16 @@ class ArXivDataset(Dataset):
 
         return lmd.Reader('components/arxiv/arxiv.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/arxiv/arxiv.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/arxiv')
 
+    def source_paths(self):
+        return ['components/arxiv']
+
     def size(self):
         return 60353358395
     
@@ -413,9 +537,16 @@ class PubMedDataset(Dataset):
 
         return lmd.Reader('components/pubmed/PUBMED_title_abstracts_2019_baseline.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/pubmed/PUBMED_title_abstracts_2019_baseline.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/pubmed')
 
+    def source_paths(self):
+        return ['components/pubmed']
+
     def size(self):
         return 20684050384
     
@@ -438,8 +569,15 @@ class ExPorterDataset(Dataset):
 
         return lmd.Reader('components/exporter/NIH_ExPORTER_awarded_grant_text.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/exporter/NIH_ExPORTER_awarded_grant_text.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/exporter')
+
+    def source_paths(self):
+        return ['components/exporter']
     
     def size(self):
         return 2034579138
@@ -466,6 +604,9 @@ class StackExchangeDataset(Dataset):
     def clean(self):
         rm_if_exists('components/stackexchange/out')
 
+    def source_paths(self):
+        return ['components/stackexchange/out']
+
     def size(self):
         return 34571286358
     
@@ -488,8 +629,15 @@ class FreeLawDataset(Dataset):
 
         return lmd.Reader('components/freelaw/FreeLaw_Opinions.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/freelaw/FreeLaw_Opinions.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/freelaw')
+
+    def source_paths(self):
+        return ['components/freelaw']
     
     def size(self):
         return 54923939791
@@ -516,6 +664,9 @@ class PubMedCentralDataset(Dataset):
     def clean(self):
         rm_if_exists('components/pubmedcentral')
 
+    def source_paths(self):
+        return ['components/pubmedcentral']
+
     def size(self):
         return 96929951580
 
@@ -545,9 +696,16 @@ class CZICDataset(Dataset):
 
         return lmd.Reader('components/czic/GOVINFO_CZIC_KL.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/czic/GOVINFO_CZIC_KL.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/czic')
 
+    def source_paths(self):
+        return ['components/czic']
+
     def size(self):
         return 837798818
 
@@ -570,9 +728,16 @@ class PhilPapersDataset(Dataset):
 
         return lmd.Reader('components/philpapers/PhilArchive.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/philpapers/PhilArchive.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/philpapers')
 
+    def source_paths(self):
+        return ['components/philpapers']
+
     def size(self):
         return 2553543227
 
@@ -598,6 +763,9 @@ class USPTODataset(Dataset):
     def clean(self):
         rm_if_exists('components/uspto')
 
+    def source_paths(self):
+        return ['components/uspto']
+
     def size(self):
         return 24593538339
 
@@ -620,9 +788,16 @@ class EuroParlDataset(Dataset):
 
         return lmd.Reader('components/europarl/EuroParliamentProceedings_1996_2011.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/europarl/EuroParliamentProceedings_1996_2011.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/europarl')
 
+    def source_paths(self):
+        return ['components/europarl']
+
     def size(self):
         return 4923130035
 
@@ -645,9 +820,16 @@ class YTSubtitlesDataset(Dataset):
 
         return lmd.Reader('components/youtubesubtitles/yt_subs.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/youtubesubtitles/yt_subs.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/youtubesubtitles')
 
+    def source_paths(self):
+        return ['components/youtubesubtitles']
+
     def size(self):
         return 4010420381
 
@@ -669,8 +851,15 @@ class HackerNewsDataset(Dataset):
 
         return lmd.Reader('components/hackernews/hn.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/hackernews/hn.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/hackernews')
+
+    def source_paths(self):
+        return ['components/hackernews']
     
     def size(self):
         return 4185091916
@@ -696,6 +885,9 @@ class FullGithubDataset(Dataset):
 
     def clean(self):
         rm_if_exists('components/github')
+
+    def source_paths(self):
+        return ['components/github']
     
     def size(self):
         return 677143668214
@@ -718,8 +910,15 @@ class GithubDataset(Dataset):
 
         return lmd.Reader('components/github/github_small.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/github/github_small.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/github')
+
+    def source_paths(self):
+        return ['components/github']
     
     def size(self):
         return 102180233200
@@ -745,6 +944,9 @@ class OpenWebText2Dataset(Dataset):
 
     def clean(self):
         rm_if_exists('components/openwebtext2')
+
+    def source_paths(self):
+        return ['components/openwebtext2']
     
     def size(self):
         return 67396380547
@@ -767,8 +969,15 @@ class CommonCrawlDataset(Dataset):
 
         return lmd.Reader('components/commoncrawl/pile_cc_filtered_deduped.jsonl.zst').stream_data(get_meta=True)
 
+    def index_source(self):
+        self._download()
+        return 'components/commoncrawl/pile_cc_filtered_deduped.jsonl.zst'
+
     def clean(self):
         rm_if_exists('components/commoncrawl')
+
+    def source_paths(self):
+        return ['components/commoncrawl']
     
     def size(self):
         return 243872121726
@@ -0,0 +1,80 @@
+import re
+import hashlib
+import functools
+
+import numpy as np
+
+from .dedupe import contains
+
+
+_whitespace = re.compile(r'\s')
+
+# multiplier for the polynomial rolling hash over word hashes; arithmetic wraps mod 2^64
+_MULT = np.uint64(0x100000001b3)
+
+# frequent words are cached; a bounded lru keeps this to a few tens of MB per worker process
+@functools.lru_cache(maxsize=2 ** 18)
+def _word_hash(word):
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def words(txt):
+    """ Word hashes and positions of txt, tokenized exactly like the original make_deduped: lowercased, split on
+    every single whitespace character, empty words dropped. A word's position is the total length of the words
+    before it (whitespace isn't counted), which is what the original cut points are based on. """
+    ws = _whitespace.split(txt.lower())
+    lens = np.fromiter(map(len, ws), dtype=np.int64, count=len(ws))
+    pos = np.cumsum(lens) - lens
+
+    keep = [i for i, w in enumerate(ws) if w.strip()]
+    hashes = np.fromiter((_word_hash(ws[i]) for i in keep), dtype=np.uint64, count=len(keep))
+    return hashes, pos[keep]
+
+
+def ngram_hashes(hashes, n):
+    # like the original, the last n-gram of the document is never looked at
+    m = len(hashes) - n
+    if m <= 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    acc = np.zeros(m, dtype=np.uint64)
+    for j in range(n):
+        acc = acc * _MULT + hashes[j:j + m]
+    return acc
+
+
+def build_excludes(texts, n=13):
+    """ Sorted array of the n-gram hashes of every text, for use with process_doc. """
+    parts = [ngram_hashes(words(txt)[0], n) for txt in texts]
+    return np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.uint64)
+
+
+def process_doc(txt, excludes, n=13):
+    """ Cut every excluded n-gram out of txt along with 200 characters of context on either side.
+    Returns the remaining pieces longer than 200 characters, or nothing if there are more than 10 of them. """
+    hashes, pos = words(txt)
+    ngs = ngram_hashes(hashes, n)
+    hits = np.nonzero(contains(excludes, ngs))[0]
+
+    if len(hits) == 0: return [txt]
+
+    delspans = [(max(0, int(pos[i]) - 200), min(len(txt), int(pos[i + n - 1]) + 200)) for i in hits]
+
+    ptr = 0
+    result = []
+    for l, r in delspans:
+        if ptr < l:
+            result.append(txt[ptr:l])
+            ptr = r
+        if l <= ptr < r:
+            ptr = r
+        if r < ptr:
+            raise AssertionError()
+
+    result.append(txt[ptr:])
+
+    result = list(filter(lambda x: len(x) > 200, result))
+
+    if len(result) > 10: return []
+
+    return result
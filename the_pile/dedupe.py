@@ -0,0 +1,45 @@
+import hashlib
+
+import numpy as np
+
+from .utils import readf, concat
+
+
+# 64 bits of sha256 is plenty: the expected number of false positives for the whole Pile is well under one document
+DIGEST_BYTES = 8
+
+
+def digests(lines):
+    """ Truncated sha256 of each line, as a uint64 array. """
+    return np.frombuffer(b''.join(hashlib.sha256(line).digest()[:DIGEST_BYTES] for line in lines), dtype='<u8')
+
+
+def build_index(files, fname, batch_size=100000):
+    """ Write the sorted, deduplicated digests of every line in files to fname (.npy). """
+    parts = []
+    batch = []
+    for line in concat(map(readf, files)):
+        batch.append(line)
+        if len(batch) >= batch_size:
+            parts.append(digests(batch))
+            batch = []
+    parts.append(digests(batch))
+
+    index = np.unique(np.concatenate(parts))
+    np.save(fname, index)
+    return index
+
+
+def load_index(fname):
+    """ Memory-map a saved index; processes that load the same file share its pages. """
+    return np.load(fname, mmap_mode='r')
+
+
+def contains(index, keys):
+    """ Vectorized membership test of keys in a sorted index. """
+    if len(index) == 0:
+        return np.zeros(len(keys), dtype=bool)
+
+    pos = np.searchsorted(index, keys)
+    pos[pos == len(index)] = 0
+    return index[pos] == keys
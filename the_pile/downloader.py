@@ -0,0 +1,231 @@
+import os
+import json
+import hashlib
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+from tqdm import tqdm
+
+from .utils import sha256sum, rm_if_exists, stream_tar_xf, tar_xf, write_members
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadError(Exception): pass
+
+
+def _probe(url, timeout):
+    """ (size, whether byte ranges are supported) for url. size is None if the server doesn't say. """
+    req = urllib.request.Request(url, method='HEAD')
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        size = resp.headers.get('Content-Length')
+        ranges = resp.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    return (int(size) if size is not None else None), ranges
+
+
+class _PartialDownload:
+    """ A .part file plus a .part.json recording how far each byte range has been fetched. """
+
+    def __init__(self, fname, size, num_ranges):
+        self.part = fname + '.part'
+        self.statefile = fname + '.part.json'
+        self.size = size
+        self.lock = threading.Lock()
+        # set when one range has failed for good, so the others stop instead of finishing first
+        self.stop = threading.Event()
+
+        self.ranges = None
+        if os.path.exists(self.statefile) and os.path.exists(self.part):
+            with open(self.statefile) as fh:
+                state = json.load(fh)
+            if state['size'] == size:
+                self.ranges = state['ranges']
+
+        if self.ranges is None:
+            # [next byte to fetch, end of range (exclusive)]
+            bounds = [size * i // num_ranges for i in range(num_ranges + 1)]
+            self.ranges = [[bounds[i], bounds[i + 1]] for i in range(num_ranges) if bounds[i] < bounds[i + 1]]
+            with open(self.part, 'wb') as fh:
+                fh.truncate(size)
+
+        self.fd = os.open(self.part, os.O_WRONLY)
+
+    def remaining(self):
+        return sum(end - pos for pos, end in self.ranges)
+
+    def write(self, i, data):
+        pos = self.ranges[i][0]
+        os.pwrite(self.fd, data, pos)
+        with self.lock:
+            self.ranges[i][0] = pos + len(data)
+
+    def save(self):
+        # positions only move forward after their data is written, so everything this snapshot claims is synced
+        # by the fsync that follows it, before the state is saved
+        with self.lock:
+            state = {'size': self.size, 'ranges': [list(r) for r in self.ranges]}
+        os.fsync(self.fd)
+        with open(self.statefile + '.tmp', 'w') as fh:
+            json.dump(state, fh)
+        os.replace(self.statefile + '.tmp', self.statefile)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _fetch_range(partial, i, urls, first_url, timeout, retries, progress):
+    # start on a different mirror per range to spread the load, and move on to the next one from the
+    # current position whenever a mirror fails partway through
+    errors = []
+    for attempt in range(retries * len(urls)):
+        url = urls[(first_url + attempt) % len(urls)]
+        pos, end = partial.ranges[i]
+        if pos >= end or partial.stop.is_set():
+            return
+
+        try:
+            req = urllib.request.Request(url, headers={'Range': 'bytes={}-{}'.format(pos, end - 1)})
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                if resp.status != 206:
+                    raise DownloadError('{} ignored the range request'.format(url))
+                while pos < end:
+                    if partial.stop.is_set():
+                        return
+                    # whatever has arrived, so a stop is noticed without waiting for a whole chunk
+                    data = resp.read1(min(CHUNK_SIZE, end - pos))
+                    if not data:
+                        raise DownloadError('{} closed the connection early'.format(url))
+                    partial.write(i, data)
+                    progress.update(len(data))
+                    pos += len(data)
+            return
+        except Exception as e:
+            errors.append('{}: {}'.format(url, e))
+
+    raise DownloadError('Failed to fetch bytes {}-{}:\n'.format(*partial.ranges[i]) + '\n'.join(errors))
+
+
+def _fetch_whole(fname, urls, timeout):
+    # no sizes or byte ranges to work with, so this can't resume; just try each mirror in turn
+    for url in urls:
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as resp, open(fname + '.part', 'wb') as fh:
+                progress = tqdm(total=resp.length, unit='B', unit_scale=True, unit_divisor=1024)
+                for data in iter(lambda: resp.read(CHUNK_SIZE), b''):
+                    fh.write(data)
+                    progress.update(len(data))
+                progress.close()
+            return
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            print('Download from {} failed, trying next mirror'.format(url))
+
+    raise DownloadError('Failed to download {} from any mirror'.format(fname))
+
+
+def fetch(fname, checksum, urls, num_ranges=8, timeout=60, retries=3, save_every=5):
+    """ Download fname from urls, which are mirrors of the same file, and check it against checksum.
+
+    When the servers support byte ranges the file is fetched as num_ranges parallel ranges, spread over the
+    mirrors. Progress is kept in fname.part and fname.part.json, so an interrupted download picks up where it
+    left off, and a range whose mirror fails midway continues on the next mirror.
+    """
+    if os.path.exists(fname):
+        try:
+            sha256sum(fname, expected=checksum)
+            return
+        except AssertionError:
+            print('{} exists but doesn\'t match checksum!'.format(fname))
+            rm_if_exists(fname)
+
+    size, ranges = None, False
+    for url in urls:
+        try:
+            size, ranges = _probe(url, timeout)
+            if size is not None: break
+        except Exception as e:
+            print('Could not reach {}: {}'.format(url, e))
+
+    if size is None or not ranges:
+        _fetch_whole(fname, urls, timeout)
+    else:
+        partial = _PartialDownload(fname, size, num_ranges)
+        progress = tqdm(total=size, initial=size - partial.remaining(), unit='B', unit_scale=True, unit_divisor=1024)
+        try:
+            with ThreadPoolExecutor(len(partial.ranges) or 1) as pool:
+                futures = [pool.submit(_fetch_range, partial, i, urls, i, timeout, retries, progress) for i in range(len(partial.ranges))]
+                while True:
+                    done, pending = wait(futures, timeout=save_every, return_when=FIRST_EXCEPTION)
+                    partial.save()
+                    try:
+                        for f in done:
+                            f.result()
+                    except:
+                        partial.stop.set()
+                        raise
+                    if not pending: break
+        finally:
+            partial.save()
+            partial.close()
+            progress.close()
+
+    try:
+        sha256sum(fname + '.part', expected=checksum)
+    except AssertionError:
+        # start over next time rather than resuming into the same bad file
+        for f in [fname + '.part', fname + '.part.json', fname + '.part.sha256']:
+            rm_if_exists(f)
+        raise
+
+    os.replace(fname + '.part', fname)
+    os.replace(fname + '.part.sha256', fname + '.sha256')
+    rm_if_exists(fname + '.part.json')
+
+
+class _HashingReader:
+    def __init__(self, fh):
+        self.fh = fh
+        self.h = hashlib.sha256()
+
+    def read(self, n=-1):
+        data = self.fh.read(n)
+        self.h.update(data)
+        return data
+
+
+def fetch_and_extract(fname, checksum, urls, timeout=60):
+    """ Download the tar fname from urls and extract it next to fname while it streams in, checking the checksum
+    on the way. If no mirror can be streamed from, falls back to fetch followed by tar_xf. """
+    parentdir = os.path.dirname(fname)
+    for url in urls:
+        members = []
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as resp:
+                reader = _HashingReader(resp)
+                stats = stream_tar_xf(reader, parentdir, members)
+                # the end-of-archive padding is part of the checksum too
+                while reader.read(CHUNK_SIZE): pass
+
+            assert reader.h.hexdigest() == checksum, 'checksum mismatch'
+            print('CHECKSUM OK', fname)
+            write_members(fname, stats)
+            return
+        except Exception as e:
+            print('Streaming extraction of {} from {} failed: {}'.format(fname, url, e))
+            for member in members:
+                rm_if_exists(os.path.join(parentdir, member.name))
+
+    fetch(fname, checksum, urls, timeout=timeout)
+    tar_xf(fname)
+    rm_if_exists(fname)
+    rm_if_exists(fname + '.sha256')
+
+
+def download_all(datasets, threads=4):
+    """ Run the downloads of several datasets at once. """
+    with ThreadPoolExecutor(threads) as pool:
+        for f in [pool.submit(dset._download) for dset in datasets]:
+            f.result()
@@ -0,0 +1,306 @@
+import os
+import random
+import collections
+import ujson as json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import zstandard
+
+from .utils import utf8len, rm_if_exists, fread, fwrite
+
+
+INDEX_DIR = 'components/index'
+
+# decompressed bytes per zstd frame; fetching a document costs at most one frame of decompression
+FRAME_SIZE = 1024 * 1024
+
+# largest frame of an existing file that build_in_place accepts
+MAX_SOURCE_FRAME_SIZE = 16 * FRAME_SIZE
+
+_doc_dtype = np.dtype([('frame', '<u4'), ('start', '<u4'), ('len', '<u4')])
+
+
+def _document(line):
+    # the same as lm_dataformat's reader with get_meta=True
+    ob = json.loads(line)
+    text = ob['text']
+    if isinstance(text, list):
+        text = '\n\n'.join(text)
+    return text, ob.get('meta', {})
+
+
+class _RecordWriter:
+    """ Writes records of dtype to the .npy file path as they come, a chunk at a time, so that an index of a
+    component with hundreds of millions of documents is never held in memory. """
+
+    def __init__(self, path, dtype, chunk_size=2 ** 16):
+        self.path = path
+        self.dtype = dtype
+        self.buf = np.empty(chunk_size, dtype=dtype)
+        self.n = 0
+        self.total = 0
+        self.fh = open(path + '.raw', 'wb')
+
+    def append(self, record):
+        self.buf[self.n] = record
+        self.n += 1
+        if self.n == len(self.buf):
+            self._flush()
+
+    def _flush(self):
+        self.fh.write(self.buf[:self.n].tobytes())
+        self.total += self.n
+        self.n = 0
+
+    def close(self):
+        self._flush()
+        self.fh.close()
+        if self.total:
+            # the .npy header needs the final length, so the records are copied over behind it chunk by chunk
+            raw = np.memmap(self.path + '.raw', dtype=self.dtype, mode='r')
+            out = np.lib.format.open_memmap(self.path, mode='w+', dtype=self.dtype, shape=(self.total,))
+            for i in range(0, self.total, len(self.buf)):
+                out[i:i + len(self.buf)] = raw[i:i + len(self.buf)]
+            out.flush()
+            del raw, out
+        else:
+            np.save(self.path, np.empty(0, dtype=self.dtype))
+        os.remove(self.path + '.raw')
+
+
+def index_path(dataset):
+    return INDEX_DIR + '/' + dataset.name().replace(' ', '_').replace('/', '_')
+
+
+class DocumentIndex:
+    """ Random access to a dataset's documents.
+
+    For every document we keep its zstd frame, its offset in the decompressed frame and its length in bytes. If
+    the source is a jsonl.zst file that is already made of small frames, those are indexed where they are
+    (build_in_place). Otherwise the output of dataset.documents() is re-framed into frames of about FRAME_SIZE
+    bytes each (build), which is a second compressed copy of the component on disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data_file = fread(path + '/source') if os.path.exists(path + '/source') else path + '/docs.jsonl.zst'
+        self.frames = np.load(path + '/frames.npy')
+        self.docs = np.load(path + '/docs.npy', mmap_mode='r')
+        self._dctx = zstandard.ZstdDecompressor()
+        self._cached_frame = (None, None)
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    @staticmethod
+    def exists(path, fingerprint=None):
+        """ Whether an index was built at path, from sources with the given fingerprint if there is one. """
+        if not os.path.exists(path + '/docs.npy'):
+            return False
+        if fingerprint is None:
+            return True
+        return os.path.exists(path + '/fingerprint') and fread(path + '/fingerprint') == fingerprint
+
+    @classmethod
+    def build(cls, documents, path, frame_size=FRAME_SIZE, get_fingerprint=None):
+        tmp = path + '.tmp'
+        rm_if_exists(tmp)
+        os.makedirs(tmp)
+
+        cctx = zstandard.ZstdCompressor(level=3)
+        frames = [0]
+        docs = _RecordWriter(tmp + '/docs.npy', _doc_dtype)
+        buf = []
+        buflen = 0
+
+        with open(tmp + '/docs.jsonl.zst', 'wb') as fh:
+            def flush():
+                nonlocal buf, buflen
+                fh.write(cctx.compress(b''.join(buf)))
+                frames.append(fh.tell())
+                buf = []
+                buflen = 0
+
+            for doc, meta in documents:
+                line = json.dumps({'text': doc, 'meta': meta}).encode('utf-8') + b'\n'
+                docs.append((len(frames) - 1, buflen, utf8len(doc)))
+                buf.append(line)
+                buflen += len(line)
+
+                if buflen >= frame_size:
+                    flush()
+            if buf:
+                flush()
+        docs.close()
+
+        np.save(tmp + '/frames.npy', np.array(frames, dtype=np.int64))
+        if get_fingerprint is not None:
+            # only known once documents has been fully consumed, since reading may download the sources
+            fwrite(tmp + '/fingerprint', get_fingerprint())
+
+        rm_if_exists(path)
+        os.rename(tmp, path)
+        return cls(path)
+
+    @classmethod
+    def build_in_place(cls, source, path, max_frame_size=MAX_SOURCE_FRAME_SIZE, get_fingerprint=None):
+        """ Index the frames of the jsonl.zst file source without copying it. Returns None, having written nothing,
+        if a frame is bigger than max_frame_size or doesn't end at the end of a line. """
+        tmp = path + '.tmp'
+        rm_if_exists(tmp)
+        os.makedirs(tmp)
+
+        frames = [0]
+        docs = _RecordWriter(tmp + '/docs.npy', _doc_dtype)
+
+        def give_up():
+            docs.close()
+            rm_if_exists(tmp)
+
+        with open(source, 'rb') as fh:
+            dobj = zstandard.ZstdDecompressor().decompressobj()
+            buf = []
+            buflen = 0
+            pending = b''
+            # file offset just past pending
+            pos = 0
+            while True:
+                if not pending:
+                    pending = fh.read(FRAME_SIZE)
+                    pos += len(pending)
+                    if not pending:
+                        break
+
+                out = dobj.decompress(pending)
+                pending = b''
+                buf.append(out)
+                buflen += len(out)
+                if buflen > max_frame_size:
+                    return give_up()
+                if not dobj.eof:
+                    continue
+
+                data = b''.join(buf)
+                if not data.endswith(b'\n'):
+                    return give_up()
+                start = 0
+                while start < len(data):
+                    end = data.index(b'\n', start)
+                    if data[start:end].strip():
+                        docs.append((len(frames) - 1, start, utf8len(_document(data[start:end])[0])))
+                    start = end + 1
+
+                pending = dobj.unused_data
+                frames.append(pos - len(pending))
+                dobj = zstandard.ZstdDecompressor().decompressobj()
+                buf = []
+                buflen = 0
+
+        if buflen:
+            # truncated last frame
+            return give_up()
+
+        docs.close()
+        np.save(tmp + '/frames.npy', np.array(frames, dtype=np.int64))
+        fwrite(tmp + '/source', source)
+        if get_fingerprint is not None:
+            fwrite(tmp + '/fingerprint', get_fingerprint())
+
+        rm_if_exists(path)
+        os.rename(tmp, path)
+        return cls(path)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def doc_lengths(self):
+        """ utf-8 byte length of every document's text. """
+        return self.docs['len']
+
+    def _read_frame(self, f, dctx=None):
+        with open(self.data_file, 'rb') as fh:
+            fh.seek(self.frames[f])
+            data = fh.read(self.frames[f + 1] - self.frames[f])
+        # frames written by a streaming compressor don't record their size, which decompress() needs
+        return (dctx or zstandard.ZstdDecompressor()).decompressobj().decompress(data)
+
+    def _frame(self, f):
+        if self._cached_frame[0] != f:
+            self._cached_frame = (f, self._read_frame(f, self._dctx))
+
+        return self._cached_frame[1]
+
+    def get(self, i):
+        frame, start, _ = self.docs[i]
+        buf = self._frame(int(frame))
+        return _document(buf[start:buf.index(b'\n', start)])
+
+    def get_many(self, indices):
+        """ Fetch documents in the order given; sorted indices decompress every frame at most once. """
+        for i in indices:
+            yield self.get(i)
+
+    def documents(self, start=0, end=None):
+        """ Documents [start, end) in order, starting with the frame that holds start, so no earlier frame is read. """
+        end = len(self) if end is None else end
+        frames = self.docs['frame']
+        i = start
+        while i < end:
+            f = int(frames[i])
+            # documents never span frames, and frames are in order
+            hi = min(end, int(np.searchsorted(frames, f, side='right')))
+            buf = self._read_frame(f, self._dctx)
+            for pos in self.docs['start'][i:hi].tolist():
+                yield _document(buf[pos:buf.index(b'\n', pos)])
+            i = hi
+
+    def sample(self, k, seed=42):
+        """ k distinct random documents, in dataset order. """
+        indices = sorted(random.Random(seed).sample(range(len(self)), k))
+        return list(self.get_many(indices))
+
+    def _epoch_plan(self, start, end, seed, epoch):
+        # the documents of each frame stay together so a frame is decompressed once per epoch; the order of the
+        # frames and of the documents within each frame is shuffled
+        frames = self.docs['frame'][start:end]
+        bounds = np.flatnonzero(np.diff(frames)) + 1
+        groups = list(zip(np.concatenate([[0], bounds]).tolist(), np.concatenate([bounds, [len(frames)]]).tolist()))
+
+        while True:
+            rng = np.random.RandomState([seed, epoch])
+            for g in rng.permutation(len(groups)).tolist():
+                lo, hi = groups[g]
+                yield epoch, int(frames[lo]), start + lo + rng.permutation(hi - lo)
+            epoch += 1
+
+    def epochs(self, start=0, end=None, seed=42, offset=0, readahead=2):
+        """ Documents [start, end) over and over, reshuffled every epoch from seed and the epoch number, skipping the
+        first offset documents. The next readahead frames are decompressed in the background, including across the
+        end of an epoch. """
+        end = len(self) if end is None else end
+        n = end - start
+        plan = self._epoch_plan(start, end, seed, offset // n)
+
+        # skip whole frames without reading them
+        skip = offset % n
+        _, frame, docs = next(plan)
+        while skip >= len(docs):
+            skip -= len(docs)
+            _, frame, docs = next(plan)
+        docs = docs[skip:]
+
+        with ThreadPoolExecutor(1) as pool:
+            pending = collections.deque([(docs, pool.submit(self._read_frame, frame))])
+            while True:
+                while len(pending) <= readahead:
+                    _, f, ds = next(plan)
+                    pending.append((ds, pool.submit(self._read_frame, f)))
+
+                docs, future = pending.popleft()
+                buf = future.result()
+                for pos in self.docs['start'][docs].tolist():
+                    yield _document(buf[pos:buf.index(b'\n', pos)])
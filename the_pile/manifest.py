@@ -0,0 +1,80 @@
+import os
+import json
+import hashlib
+import collections
+
+from .utils import utf8len
+
+
+MANIFEST_DIR = 'components/manifests'
+
+
+def fingerprint(paths):
+    """ Checksum over the names, sizes and modification times of every file under paths. Changes whenever any of them is modified. """
+    h = hashlib.sha256()
+    for path in sorted(paths):
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = sorted(os.path.join(root, f) for root, _, fs in os.walk(path) for f in fs)
+
+        for f in files:
+            st = os.stat(f)
+            h.update('{}\0{}\0{}\n'.format(f, st.st_size, st.st_mtime_ns).encode('utf-8'))
+
+    return h.hexdigest()
+
+
+def manifest_path(dataset):
+    return MANIFEST_DIR + '/' + dataset.name().replace(' ', '_').replace('/', '_') + '.json'
+
+
+def length_bucket(n):
+    """ Histogram bucket for a document of n bytes: bucket k holds lengths in [2^(k-1), 2^k). """
+    return n.bit_length()
+
+
+def summarize(lengths):
+    """ Manifest fields for a stream of document lengths in bytes. """
+    total = 0
+    n = 0
+    hist = collections.Counter()
+    for length in lengths:
+        total += length
+        n += 1
+        hist[length_bucket(length)] += 1
+
+    return {
+        'bytes': total,
+        'num_docs': n,
+        'length_histogram': {str(k): v for k, v in sorted(hist.items())},
+    }
+
+
+def load_manifest(dataset):
+    """ The saved manifest for dataset, or None if there isn't one or its source files have changed since. """
+    fname = manifest_path(dataset)
+    if not os.path.exists(fname):
+        return None
+
+    with open(fname) as fh:
+        manifest = json.load(fh)
+
+    if manifest['fingerprint'] != fingerprint(dataset.source_paths()):
+        return None
+
+    return manifest
+
+
+def build_manifest(dataset, lengths):
+    """ Summarize lengths (one pass over dataset) and save it as dataset's manifest. """
+    manifest = summarize(lengths)
+    # the pass may have downloaded or extracted the files, so the fingerprint comes after it
+    manifest['fingerprint'] = fingerprint(dataset.source_paths())
+
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    with open(manifest_path(dataset) + '.tmp', 'w') as fh:
+        json.dump(manifest, fh, indent=2)
+    os.replace(manifest_path(dataset) + '.tmp', manifest_path(dataset))
+
+    return manifest
@@ -0,0 +1,57 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import zstandard
+from tqdm import tqdm
+
+from .utils import ls, fread
+
+
+def pack_path(dirname):
+    return dirname.rstrip('/') + '.pack'
+
+
+def pack_directory(dirname, out=None):
+    """ Pack every file in dirname, in ls() order, into one file of concatenated zstd frames (one per file) plus an
+    offset table. This is a one-time conversion: delete the .pack files to repack after the directory changes. """
+    out = out or pack_path(dirname)
+    files = ls(dirname)
+    cctx = zstandard.ZstdCompressor(level=3)
+
+    offsets = [0]
+    with open(out + '.tmp', 'wb') as fh:
+        for f in tqdm(files):
+            # fread's decoding, so documents come out exactly as they did from the directory
+            fh.write(cctx.compress(fread(f).encode('utf-8')))
+            offsets.append(fh.tell())
+
+    np.save(out + '.idx.npy', np.array(offsets, dtype=np.int64))
+    with open(out + '.names.json', 'w') as fh:
+        json.dump([os.path.basename(f) for f in files], fh)
+    os.rename(out + '.tmp', out)
+
+
+def _decompress(frame):
+    return zstandard.ZstdDecompressor().decompress(frame).decode('utf-8')
+
+
+def read_packed(path, threads=4, batch_size=64):
+    """ Documents of a packed directory, read sequentially in large blocks and decoded on threads batch by batch. """
+    offsets = np.load(path + '.idx.npy')
+    sizes = np.diff(offsets).tolist()
+
+    with open(path, 'rb', buffering=16 * 1024 * 1024) as fh, ThreadPoolExecutor(threads) as pool:
+        for i in range(0, len(sizes), batch_size):
+            frames = [fh.read(n) for n in sizes[i:i + batch_size]]
+            yield from pool.map(_decompress, frames)
+
+
+def packed_documents(dirname, threads=4):
+    """ The contents of every file in dirname in ls() order, like map(fread, ls(dirname)), packing it on first use. """
+    if not os.path.exists(pack_path(dirname)):
+        print('Packing', dirname)
+        pack_directory(dirname)
+
+    return read_packed(pack_path(dirname), threads=threads)
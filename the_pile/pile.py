@@ -1,4 +1,5 @@
 import time
+import zlib
 import random
 import fasttext
 
@@ -7,6 +8,11 @@ from tqdm import tqdm
 
 from the_pile.utils import humanbytes, parse_size
 from the_pile.datasets import *
+from the_pile.archive import Archive, ArchiveProcess
+from the_pile.schedule import ByteQuotaScheduler
+from the_pile.profiler import Profiler
+from the_pile.tokens import TokenWriter, tokenize_documents, bytes_per_token, token_counter, count_tokens
+from the_pile.downloader import download_all
 
 
 datasets = [
@@ -99,92 +105,202 @@ def mk_table(datasets, train_chars, print_latex=False):
     return writer.dumps()
 
 
+def _as_tuple(x):
+    # random.setstate wants the nested tuples back after a round trip through json
+    return tuple(map(_as_tuple, x)) if isinstance(x, list) else x
+
+
+def save_checkpoint(fname, state):
+    with open(fname + '.tmp', 'w') as fh:
+        json.dump(state, fh)
+    os.replace(fname + '.tmp', fname)
+
+
+def load_checkpoint(fname):
+    with open(fname) as fh:
+        return json.load(fh)
+
+
 def dataset_tqdm(dset):
     if isinstance(dset, PileReplication):
         return dset.documents()
     pbar = tqdm(total=dset.size(), unit='B', unit_scale=True, unit_divisor=1024)
-    for doc in dset.documents():
+    for doc, meta in dset.documents():
         pbar.update(utf8len(doc))
-        yield doc 
-
-
-class Profiler:
-    def __init__(self, profile):
-        self.i = 0
-        self.profile = profile
-        self.time_per_dataset = collections.defaultdict(lambda: [0, 0])
-
-    def measured_next(self, name, iter):
-        if not self.profile:
-            # no-op
-            return next(iter)
-        else:
-            self.i += 1
-            start = time.time()
-            doc = next(iter)
-            elapsed = time.time() - start
-
-            self.time_per_dataset[name][0] += elapsed
-            self.time_per_dataset[name][1] += 1
-
-            if self.i % 100000 == 0:
-                times = [(dsname, total, ct) for dsname, (total, ct) in self.time_per_dataset.items()]
-                times.sort(key=lambda x: x[1])
-                for name, total, ct in times:
-                    print(name.ljust(22), '{:.8f}'.format(total / ct), str(ct).rjust(8), '{:.4f}'.format(total))
-            
-            return doc
+        yield doc, meta
 
 
 class PileReplication(Dataset):
-    def __init__(self, datasets, dataset_bytes, profile=False):
+    def __init__(self, datasets, dataset_bytes, profile=False, prefetch=False, num_shards=1, shard_index=0, byte_schedule=False, epochs=False,
+                 token_budget=None, tokenizer='gpt2', exact_tokens=False, profiler=None):
+        assert 0 <= shard_index < num_shards
         self.datasets = datasets
         self.dataset_bytes = dataset_bytes
         self.profile = profile
-        self.rnd = random.Random(42)
+        self.profiler = profiler or Profiler(profile)
+        self.prefetch = prefetch
+        self.num_shards = num_shards
+        self.shard_index = shard_index
+        # pick components by byte quota (mk_table's weights) instead of sampling by document count
+        self.byte_schedule = byte_schedule
+        # cycle components through their indices, reshuffling each epoch, instead of rereading them in order
+        self.epochs = epochs
+
+        # every shard reads 1/num_shards of each component, so it also gets 1/num_shards of the bytes
+        self.shard_bytes = dataset_bytes / num_shards
+
+        # with a token budget, the output is measured in tokens: estimated from each component's bytes per token, or
+        # counted exactly by tokenizing on a process pool
+        self.token_budget = token_budget
+        self.tokenizer = tokenizer
+        self.exact_tokens = exact_tokens
+        self.rnd = random.Random(42 + shard_index)
+        self.resume_state = None
     
     def name(self):
+        if self.num_shards > 1:
+            return "Custom Pile (shard {}/{})".format(self.shard_index, self.num_shards)
         return "Custom Pile"
 
+    def restore(self, state):
+        """ Make the next call to documents() continue from a state previously returned by state(). """
+        self.resume_state = state
+
+    def state(self):
+        """ The position just after the last document yielded from documents(), as a json-serializable dict. """
+        rnd_state, chunk_pos, total_bytes = self._position
+        state = {
+            'chunk_pos': chunk_pos,
+            'total_bytes': total_bytes,
+            'offsets': dict(self._offsets),
+        }
+        if self.byte_schedule:
+            # the chunk is rebuilt from where the scheduler was at its start, but the byte counts have to be current
+            state['schedule'] = rnd_state
+            state['emitted'] = self._scheduler.emitted.tolist()
+        else:
+            state['rnd'] = rnd_state
+        return state
+
+    def _epoch_seed(self, dataset):
+        # a different shuffle for every component and shard
+        return zlib.crc32(dataset.name().encode('utf-8')) + self.shard_index
+
+    def epochs_consumed(self):
+        """ How many passes over its share of each component the documents so far add up to. """
+        result = {}
+        for dataset, _ in self.datasets:
+            # sharded and epoch reads go through the index, so their shards have exact sizes
+            n = len(dataset.index()) if self.epochs or self.num_shards > 1 else dataset.num_docs()
+            start, end = shard_range(n, self.shard_index, self.num_shards)
+            result[dataset.name()] = self._offsets.get(dataset.name(), 0) / (end - start)
+        return result
+
     def documents(self):
         datasets = []
         weights = []
 
+        resume = self.resume_state
+        self._offsets = dict(resume['offsets']) if resume else collections.defaultdict(int)
+
         # calculate relative_weight for each
         total_weight = sum([x[1] * x[0].num_docs() for x in self.datasets])
         for dataset, weight in self.datasets:
             size = dataset.size()
             relative_weight = weight * dataset.num_docs() / total_weight
-            datasets.append((dataset.name(), cycle_documents(dataset)))
+            offset = self._offsets.get(dataset.name(), 0)
+            # each component is consumed in order either way, so prefetching doesn't change the output
+            if self.prefetch:
+                docs = prefetch_documents(dataset, shard_index=self.shard_index, num_shards=self.num_shards, offset=offset, epochs=self.epochs, seed=self._epoch_seed(dataset), profiler=self.profiler)
+            elif self.epochs:
+                docs = epoch_shard_documents(dataset, self.shard_index, self.num_shards, offset, seed=self._epoch_seed(dataset))
+            else:
+                docs = cycle_shard_documents(dataset, self.shard_index, self.num_shards, offset)
+            datasets.append((dataset.name(), docs))
             weights.append(relative_weight)
+            self._offsets[dataset.name()] = offset
         
         # yield from dataset until right number of bytes
-        total_bytes = 0
-        pbar = tqdm(total=self.dataset_bytes, unit='B', unit_scale=True, unit_divisor=1024)
-
-
-        profiler = Profiler(profile=self.profile)
+        total_bytes = resume['total_bytes'] if resume else 0
+        skip = resume['chunk_pos'] if resume else 0
+        if resume and not self.byte_schedule:
+            self.rnd.setstate(_as_tuple(resume['rnd']))
+
+        # total_bytes and the byte schedule count tokens instead when there's a token budget
+        if self.token_budget:
+            bpt = [bytes_per_token(dataset, self.tokenizer) for dataset, _ in self.datasets]
+            budget = self.token_budget / self.num_shards
+            pbar = tqdm(total=budget, initial=total_bytes, unit='tok', unit_scale=True)
+        else:
+            bpt = [1] * len(self.datasets)
+            budget = self.shard_bytes
+            pbar = tqdm(total=budget, initial=total_bytes, unit='B', unit_scale=True, unit_divisor=1024)
+
+        scheduler = self._scheduler = None
+        if self.byte_schedule:
+            scheduler = ByteQuotaScheduler(
+                [weight * dataset.size() / b for (dataset, weight), b in zip(self.datasets, bpt)],
+                [dataset.size() / dataset.num_docs() / b for (dataset, _), b in zip(self.datasets, bpt)],
+                seed=42 + self.shard_index,
+                state=resume['schedule'] if resume else None,
+            )
+            self._scheduler = scheduler
+
+        pool = token_counter(self.tokenizer) if self.token_budget and self.exact_tokens else None
+
+        profiler = self.profiler
         while True:
-            chunk = self.rnd.choices(population=datasets, weights=weights, k=1000)
-            for name, dset in chunk:
-                doc, meta = profiler.measured_next(name, dset)
-
-                size = utf8len(doc)
+            with profiler.stage('mix'):
+                if scheduler:
+                    rnd_state = scheduler.state()
+                    components = scheduler.next_chunk().tolist()
+                    if skip:
+                        scheduler.emitted[:] = resume['emitted']
+                else:
+                    rnd_state = self.rnd.getstate()
+                    components = self.rnd.choices(population=range(len(datasets)), weights=weights, k=1000)
+
+            docs = ((component, profiler.measured_next(*datasets[component])) for component in components[skip:])
+            if pool:
+                # read the whole chunk so it can be tokenized in parallel; what's left over at the end is discarded
+                docs = list(docs)
+                with profiler.stage('tokenize', nbytes=sum(utf8len(doc) for _, (doc, _) in docs) if self.profile else 0):
+                    counts = count_tokens(pool, [doc for _, (doc, _) in docs])
+
+            for i, (component, (doc, meta)) in enumerate(docs, skip):
+                name = datasets[component][0]
+
+                if pool:
+                    size = counts[i - skip]
+                elif self.token_budget:
+                    size = utf8len(doc) / bpt[component]
+                else:
+                    size = utf8len(doc)
                 total_bytes += size
+                if scheduler:
+                    scheduler.add(component, size)
                 pbar.update(size)
 
                 meta['pile_set_name'] = name
 
+                self._offsets[name] += 1
+                self._position = (rnd_state, i + 1, total_bytes)
                 yield doc, meta
 
-                if total_bytes > self.dataset_bytes:
+                if total_bytes > budget:
+                    if pool: pool.terminate()
                     return
 
+            skip = 0
+
     def clean(self):
         for dataset, _ in self.datasets: dataset.clean()
+
+    def source_paths(self):
+        return [path for dataset, _ in self.datasets for path in dataset.source_paths()]
     
     def size(self):
-        return self.dataset_bytes
+        return self.shard_bytes
 
 
 class ThePile(Dataset):
@@ -202,6 +318,9 @@ class ThePile(Dataset):
 
     def clean(self):
         rm_if_exists('pile_output')
+
+    def source_paths(self):
+        return ['pile_output']
     
     def size(self):
         return 1200 * 1024 * 1024 * 1024
@@ -216,6 +335,10 @@ class LimitedDataset(Dataset):
         return self.dataset.name() + " (truncated)"
 
     def documents(self):
+        if self.dataset.has_index():
+            yield from self._indexed_documents()
+            return
+
         numer = self.limit_size
         denom = self.dataset.size()
         for doc, meta in dataset_tqdm(self.dataset):
@@ -227,9 +350,29 @@ class LimitedDataset(Dataset):
 
             if numer <= 0 or denom <= 0:
                 break
+
+    def _indexed_documents(self):
+        # same choices as the streaming version, but made from the document lengths alone so only the chosen documents are read
+        index = self.dataset.index()
+        numer = self.limit_size
+        denom = self.dataset.size()
+        chosen = []
+        for i, docsize in enumerate(index.doc_lengths().tolist()):
+            if self.rnd.random() < numer / denom:
+                chosen.append(i)
+                numer -= docsize
+            denom -= docsize
+
+            if numer <= 0 or denom <= 0:
+                break
+
+        yield from index.get_many(tqdm(chosen))
     
     def clean(self):
         self.dataset.clean()
+
+    def source_paths(self):
+        return self.dataset.source_paths()
     
     def size(self):
         return self.limit_size
@@ -276,23 +419,12 @@ def lang_stats(pile):
 
 
 def sample_from_sets(datasets, n_docs):
-    random.seed(42)
     for dset, _ in datasets:
         print(dset.name())
         fname = 'dataset_samples/{}.json'.format(dset.name().replace(' ', '_'))
         if os.path.exists(fname): continue
 
-        n = dset.num_docs()
-
-        indices = set(random.sample(range(n), n_docs))
-        pbar = tqdm(total=n_docs)
-
-        docs = []
-        for i, (doc, meta) in enumerate(dset.documents()):
-            if i > max(indices): break
-            if i in indices:
-                docs.append((doc, meta))
-                pbar.update(1)
+        docs = dset.sample(n_docs, seed=42)
         
         try:
             os.mkdir('dataset_samples')
@@ -302,8 +434,6 @@ def sample_from_sets(datasets, n_docs):
         with open(fname, 'w') as fh:
             json.dump(docs, fh)
 
-        pbar.close()
-
 
 def docs_for_dedupe():
     # format: ((priority, offset, sha256sum), document)
@@ -316,26 +446,50 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='Process some integers.')
     parser.add_argument('--force_download', action='store_true', help='force download all')
+    parser.add_argument('--verify_downloads', action='store_true', help='re-verify the checksums of all downloaded components')
     parser.add_argument('--limit', type=str, help='limit output size - this option causes read_amount tokens to be generated and then limit tokens to be sampled')
     parser.add_argument('--using', type=str, default='pile', help='the dataset to use')
     parser.add_argument('--chunk', type=str, help='output chunk size (for make_lmd)')
     parser.add_argument('--interleave_output', type=int, help='output interleaved chunks (for make_lmd)')
     parser.add_argument('--make_dummy', action='store_true', help='dummy consumer')
     parser.add_argument('--make_lmd', action='store_true', help='generate lm_dataformat')
+    parser.add_argument('--parallel_write', action='store_true', help='compress each output archive in its own process (for make_lmd)')
+    parser.add_argument('--make_tokens', action='store_true', help='generate pre-tokenized binary shards')
+    parser.add_argument('--tokenizer', type=str, default='gpt2', help='huggingface tokenizer (for make_tokens and token_budget)')
+    parser.add_argument('--tokens_per_shard', type=str, default='1G', help='tokens per output shard (for make_tokens)')
     parser.add_argument('--make_fasttext', action='store_true', help='make data for fasttext')
     parser.add_argument('--make_lang_analysis', action='store_true', help='make language analysis data')
     parser.add_argument('--make_dataset_samples', type=int, help='make dataset sample data')
+    parser.add_argument('--make_index', action='store_true', help='build random access indices for all components (components that aren\'t already in small zstd frames are copied into components/index)')
     parser.add_argument('--profile', action='store_true', help='turn on profiler')
+    parser.add_argument('--metrics_file', type=str, help='where the profiler saves its metrics; .csv appends rows, otherwise a json snapshot')
+    parser.add_argument('--profile_sample', type=int, default=1, help='only time every nth call of each stage (for profile)')
+    parser.add_argument('--prefetch', action='store_true', help='read each component in its own worker process (for pile_reprod)')
     parser.add_argument('--read_amount', type=str, help='the size of the data read from the set')
+    parser.add_argument('--token_budget', type=str, help='amount of output in tokens instead of bytes, e.g. 300G (for pile_reprod)')
+    parser.add_argument('--exact_tokens', action='store_true', help='count tokens exactly instead of estimating them from a sample (for --token_budget)')
+    parser.add_argument('--byte_schedule', action='store_true', help='hold each component to its byte share in every chunk of output (for pile_reprod)')
+    parser.add_argument('--epochs', action='store_true', help='cycle components by exact epochs through their indices, reshuffled every epoch (for pile_reprod)')
+    parser.add_argument('--num_shards', type=int, default=1, help='split pile_reprod into this many disjoint shards; each shard reads its part of every component from the component index (see --make_index)')
+    parser.add_argument('--shard_index', type=int, default=0, help='which shard to build (for --num_shards)')
+    parser.add_argument('--checkpoint', type=str, help='checkpoint file for make_lmd; resumes from it if it exists, seeking in the component indices (see --make_index)')
+    parser.add_argument('--checkpoint_every', type=str, default='10G', help='amount of output between checkpoints')
 
     args = parser.parse_args()
-    random.seed(42)
+    random.seed(42 + args.shard_index)
+    profiler = Profiler(args.profile, metrics_file=args.metrics_file, sample_every=args.profile_sample)
 
     if args.using != 'pile_reprod_no_cc':
         # add CC
         datasets.append((CommonCrawlDataset(), 1.))
 
-    if args.read_amount is None:
+    if args.token_budget:
+        args.token_budget = parse_size(args.token_budget)
+        # bytes it should take to reach the budget, with the same epochs per component as a byte budget would give
+        weighted_bytes = sum([ds.size() * epochs for ds, epochs in datasets])
+        weighted_tokens = sum([ds.size() * epochs / bytes_per_token(ds, args.tokenizer) for ds, epochs in datasets])
+        args.read_amount = args.token_budget * weighted_bytes / weighted_tokens
+    elif args.read_amount is None:
         args.read_amount = sum([ds.size() * epochs for ds, epochs in datasets])
     else:
         args.read_amount = parse_size(args.read_amount)
@@ -343,7 +497,8 @@ if __name__ == '__main__':
     print(mk_table(datasets, args.read_amount))
 
     if args.using == 'pile_reprod' or args.using == 'pile_reprod_no_cc':
-        pile = PileReplication(datasets, args.read_amount, profile=args.profile)
+        pile = PileReplication(datasets, args.read_amount, profile=args.profile, profiler=profiler, prefetch=args.prefetch, num_shards=args.num_shards, shard_index=args.shard_index, byte_schedule=args.byte_schedule, epochs=args.epochs,
+                               token_budget=args.token_budget, tokenizer=args.tokenizer, exact_tokens=args.exact_tokens)
     elif args.using == 'cc':
         pile = CommonCrawlDataset()
     elif args.using == 'pile':
@@ -355,9 +510,13 @@ if __name__ == '__main__':
     else:
         print('We don\'t have a shortcut for that yet!')
 
+    assert args.num_shards == 1 or isinstance(pile, PileReplication), 'sharding is only supported for pile_reprod'
+
     if args.force_download:
-        for dset, _ in datasets:
-            dset._download()
+        download_all([dset for dset, _ in datasets])
+
+    if args.verify_downloads:
+        verify_downloads()
     
     if args.limit:
         size_limit = parse_size(args.limit)
@@ -366,35 +525,96 @@ if __name__ == '__main__':
     if args.make_lmd:
         assert not (args.interleave_output and args.chunk) # can't chunk and interleave
 
+        archive_name = args.using
+        if args.num_shards > 1:
+            archive_name += '_shard{}'.format(args.shard_index)
+
+        ckpt = None
+        if args.checkpoint:
+            assert isinstance(pile, PileReplication), 'checkpointing is only supported for pile_reprod'
+            checkpoint_size = parse_size(args.checkpoint_every)
+            if os.path.exists(args.checkpoint):
+                ckpt = load_checkpoint(args.checkpoint)
+                print('Resuming from', args.checkpoint)
+
         if args.interleave_output:
-            ars = [lmd.Archive('pile_pass1/chunk{}'.format(i)) for i in range(args.interleave_output)]
+            outdirs = ['pile_pass1/chunk{}'.format(i) for i in range(args.interleave_output)]
         else:
-            ar = lmd.Archive('pile_output')
+            outdirs = ['pile_output']
+        archive_cls = ArchiveProcess if args.parallel_write else Archive
+        ars = [archive_cls(outdir, state=ckpt['archives'][i] if ckpt else None) for i, outdir in enumerate(outdirs)]
+        ar = ars[0]
+        if args.parallel_write:
+            for outdir, x in zip(outdirs, ars):
+                profiler.watch_queue('write ' + outdir, x.requests)
 
         if args.chunk:
             chunk_size = parse_size(args.chunk)
 
         cursize = 0
+        since_checkpoint = 0
+        if ckpt:
+            pile.restore(ckpt['pile'])
+            random.setstate(_as_tuple(ckpt['random']))
+            cursize = ckpt['cursize']
+
         for doc, meta in pile.documents():
             if args.interleave_output:
                 ar = random.choice(ars)
             
-            ar.add_data(doc, meta)
+            with profiler.stage('write', meta.get('pile_set_name'), utf8len(doc) if args.profile else 0):
+                ar.add_data(doc, meta)
                 
             cursize += len(doc)
             if args.chunk and cursize > chunk_size:
                 # interleave will not be on
                 cursize = 0
-                ar.commit(archive_name=args.using)
+                ar.commit(archive_name=archive_name)
+
+            since_checkpoint += len(doc)
+            if args.checkpoint and since_checkpoint > checkpoint_size:
+                since_checkpoint = 0
+                with profiler.stage('checkpoint'):
+                    save_checkpoint(args.checkpoint, {
+                        'archives': [x.checkpoint() for x in ars],
+                        'pile': pile.state(),
+                        'random': random.getstate(),
+                        'cursize': cursize,
+                    })
         
-        if args.interleave_output:
-            for ar in ars: ar.commit(archive_name=args.using)
-        else:
-            ar.commit(archive_name=args.using)
+        with profiler.stage('commit'):
+            for ar in ars: ar.commit(archive_name=archive_name)
+            for ar in ars: ar.close()
+        if args.profile:
+            profiler.report()
+
+        if isinstance(pile, PileReplication):
+            for name, epochs in pile.epochs_consumed().items():
+                print(name.ljust(22), '{:.4f} epochs'.format(epochs))
+
+        if args.checkpoint:
+            rm_if_exists(args.checkpoint)
+
+    if args.make_tokens:
+        outdir = 'pile_tokens'
+        if args.num_shards > 1:
+            outdir += '/shard{}'.format(args.shard_index)
+
+        writer = TokenWriter(outdir, shard_tokens=int(parse_size(args.tokens_per_shard)))
+        pbar = tqdm(unit=' tokens', unit_scale=1)
+        for ids, meta in tokenize_documents(pile.documents(), tokenizer=args.tokenizer):
+            writer.add_tokens(ids, meta.get('pile_set_name', args.using))
+            pbar.update(len(ids))
+        writer.close()
+        pbar.close()
 
     if args.make_fasttext:
         make_fasttext(pile.documents(), 0.1)
     
+    if args.make_index:
+        for dset, _ in datasets:
+            dset.index()
+
     if args.make_dataset_samples:
         sample_from_sets(datasets, args.make_dataset_samples)
     
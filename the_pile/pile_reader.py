@@ -0,0 +1,152 @@
+import io
+import os
+import queue
+import itertools
+import threading
+import multiprocessing as mp
+
+import zstandard
+
+try:
+    import simdjson as json
+except ImportError:
+    print('Installing simdjson library')
+    os.system('pip install -q pysimdjson')
+    import simdjson as json
+
+try:
+    # GFile also reads gs:// paths, which is where tfds keeps its downloads when building to GCS
+    import tensorflow as tf
+    _open = tf.io.gfile.GFile
+except ImportError:
+    _open = open
+
+
+def json_parser(x, parser=None):
+    """ Parse one line, reusing parser (a simdjson.Parser) if given. Lines that aren't valid json come back as they are. """
+    try:
+        ob = (parser or json.Parser()).parse(x)
+        return ob.as_dict() if isinstance(ob, json.Object) else ob
+    except ValueError:
+        return x
+
+
+def _put(q, item, stop):
+    # a bounded put that gives up once the reader is closed, so workers don't block forever
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _read_worker(filename, para_joiner, block_size, q, stop, decoding):
+    try:
+        # one parser per worker; simdjson reuses its buffers between documents
+        parser = json.Parser()
+        with _open(filename, 'rb') as f:
+            reader_stream = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f))
+            lines = (line for line in reader_stream if line.strip())
+            while True:
+                # only hold a decoding slot while decoding, never while waiting on the queue
+                with decoding:
+                    block = [PileReader.to_example(json_parser(line, parser), para_joiner) for line in itertools.islice(lines, block_size)]
+                if not block:
+                    break
+                if not _put(q, block, stop): return
+        _put(q, None, stop)
+    except Exception as e:
+        _put(q, e, stop)
+
+
+class PileReader:
+    """ Reads the examples of every shard in filenames.
+
+    interleave shards are open at once and their output is interleaved round robin in blocks of block_size examples.
+    When a shard runs out the next one takes its slot, so the order only depends on the files, interleave and
+    block_size. Each open shard has its own thread (or process, with use_processes=True), of which at most
+    num_workers decode at the same time; num_workers changes the speed, never the order.
+    """
+
+    def __init__(self, filenames, para_joiner='\n\n', interleave=8, num_workers=os.cpu_count(), block_size=256, use_processes=False):
+        if not isinstance(filenames, list):
+            filenames = [filenames]
+        self.filenames = filenames
+        self.para_joiner = para_joiner
+        self.interleave = max(1, interleave)
+        self.num_workers = max(1, num_workers)
+        self.block_size = block_size
+        self.use_processes = use_processes
+
+    @staticmethod
+    def to_example(item, para_joiner='\n\n'):
+        result = dict()
+        if isinstance(item, (str, bytes)):
+            text = item
+        else:
+            text = item['text']
+        if isinstance(text, list):
+            text = para_joiner.join(text)
+        if isinstance(text, bytes):
+            text = text.decode('utf-8').rstrip('\n')
+        result['text'] = text
+        return result
+
+    def _start(self, filename, stop, decoding):
+        args = (filename, self.para_joiner, self.block_size)
+        if self.use_processes:
+            q = mp.Queue(4)
+            worker = mp.Process(target=_read_worker, args=args + (q, stop, decoding), daemon=True)
+        else:
+            q = queue.Queue(4)
+            worker = threading.Thread(target=_read_worker, args=args + (q, stop, decoding), daemon=True)
+        worker.start()
+        return q, worker
+
+    def _shutdown(self, q, worker):
+        # keep taking blocks off the queue until the worker is gone, so that neither it nor a process queue's
+        # feeder thread is left waiting to hand over blocks nobody will read. Workers must not cancel their
+        # feeder thread themselves: exiting halfway through writing a block would leave a partial message here.
+        while worker.is_alive():
+            try:
+                q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        if self.use_processes:
+            q.cancel_join_thread()
+        worker.join()
+
+    def __iter__(self):
+        if self.use_processes:
+            stop, decoding = mp.Event(), mp.Semaphore(self.num_workers)
+        else:
+            stop, decoding = threading.Event(), threading.Semaphore(self.num_workers)
+        pending = list(reversed(self.filenames))
+        active = []
+        try:
+            while pending or active:
+                while pending and len(active) < self.interleave:
+                    active.append(self._start(pending.pop(), stop, decoding))
+
+                i = 0
+                while i < len(active):
+                    q, worker = active[i]
+                    block = q.get()
+                    if isinstance(block, Exception):
+                        raise block
+                    if block is None:
+                        worker.join()
+                        # the next shard takes over this slot, keeping the rotation the same
+                        if pending:
+                            active[i] = self._start(pending.pop(), stop, decoding)
+                        else:
+                            del active[i]
+                        continue
+                    yield from block
+                    i += 1
+        finally:
+            stop.set()
+            for q, worker in active:
+                self._shutdown(q, worker)
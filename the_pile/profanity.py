@@ -0,0 +1,85 @@
+import re
+
+
+# From https://stackoverflow.com/a/31505798, with the patterns compiled once
+alphabets= "([A-Za-z])"
+prefixes = "(Mr|St|Mrs|Ms|Dr)[.]"
+suffixes = "(Inc|Ltd|Jr|Sr|Co)"
+starters = r"(Mr|Mrs|Ms|Dr|He\s|She\s|It\s|They\s|Their\s|Our\s|We\s|But\s|However\s|That\s|This\s|Wherever)"
+acronyms = "([A-Z][.][A-Z][.](?:[A-Z][.])?)"
+websites = "[.](com|net|org|io|gov)"
+
+substitutions = [(re.compile(pattern), repl) for pattern, repl in [
+    (prefixes, "\\1<prd>"),
+    (websites, "<prd>\\1"),
+    (r"\s" + alphabets + "[.] ", " \\1<prd> "),
+    (acronyms + " " + starters, "\\1<stop> \\2"),
+    (alphabets + "[.]" + alphabets + "[.]" + alphabets + "[.]", "\\1<prd>\\2<prd>\\3<prd>"),
+    (alphabets + "[.]" + alphabets + "[.]", "\\1<prd>\\2<prd>"),
+    (" " + suffixes + "[.] " + starters, " \\1<stop> \\2"),
+    (" " + suffixes + "[.]", " \\1<prd>"),
+    (" " + alphabets + "[.]", " \\1<prd>"),
+]]
+whitespace = re.compile(r'\s+')
+
+
+def split_into_sentences(text):
+    text = " " + text + "  "
+    text = text.replace("\n"," ")
+    for i, (pattern, repl) in enumerate(substitutions):
+        if i == 2 and "Ph.D" in text: text = text.replace("Ph.D.","Ph<prd>D<prd>")
+        text = pattern.sub(repl, text)
+    if "”" in text: text = text.replace(".”","”.")
+    if "\"" in text: text = text.replace(".\"","\".")
+    if "!" in text: text = text.replace("!\"","\"!")
+    if "?" in text: text = text.replace("?\"","\"?")
+    text = text.replace(".",".<stop>")
+    text = text.replace("?","?<stop>")
+    text = text.replace("!","!<stop>")
+    text = text.replace("<prd>",".")
+
+    # return quotes to normal
+    text = text.replace("\".", ".\"")
+    text = text.replace("”.", ".”")
+    text = text.replace("\"!", "!\"")
+    text = text.replace("”!", "!”")
+    text = text.replace("\"?", "?\"")
+    text = text.replace("”?", "?”")
+    sentences = text.split("<stop>")
+    sentences = sentences[:-1]
+    sentences = [s.strip() for s in sentences]
+    return sentences
+
+
+def words(sent): return whitespace.split(sent)
+
+
+def sentence_profanity(docs, languages, is_profane):
+    """ For each doc, (profane, number of words, number of profane words) of every English sentence, and its size.
+    languages(sentences) gives a language code per sentence and is_profane(texts) a 0 or 1 per text; each is called
+    once across all of docs, is_profane once for the sentences and once for their distinct words. """
+    doc_sents = [[sent for sent in split_into_sentences(doc) if sent != ''] for doc in docs]
+    all_sents = [sent for sents in doc_sents for sent in sents]
+    english = [lang == 'en' for lang in languages(all_sents)] if all_sents else []
+
+    sents = [sent for sent, en in zip(all_sents, english) if en]
+    p_sents = is_profane(sents) if sents else []
+
+    sentwords = list(map(words, sents))
+    vocab = sorted(set(word for ws in sentwords for word in ws))
+    p_vocab = dict(zip(vocab, is_profane(vocab))) if vocab else {}
+    n_prof = [sum(p_vocab[word] for word in ws) for ws in sentwords]
+    sentences = list(zip(p_sents, map(len, sentwords), n_prof))
+
+    res = []
+    i = 0
+    j = 0
+    for doc, sents in zip(docs, doc_sents):
+        n_english = sum(english[i:i + len(sents)])
+        i += len(sents)
+        res.append({
+            'sentences': sentences[j:j + n_english],
+            'num_bytes': len(doc.encode('utf-8')),
+        })
+        j += n_english
+    return res
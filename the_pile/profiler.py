@@ -0,0 +1,140 @@
+import os
+import csv
+import json
+import time
+import contextlib
+import collections
+
+from .utils import utf8len
+
+
+class _Timer:
+    __slots__ = ('profiler', 'stage', 'component', 'nbytes', 'start')
+
+    def __init__(self, profiler, stage, component, nbytes):
+        self.profiler = profiler
+        self.stage = stage
+        self.component = component
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.stage, self.component, time.perf_counter_ns() - self.start, nbytes=self.nbytes)
+
+
+_null = contextlib.nullcontext()
+
+
+class Profiler:
+    """ Time spent, documents and bytes per pipeline stage and component.
+
+    Wrap a stage in `with profiler.stage('write', component, nbytes):`, or use measured_next for reading from a
+    component. Only every sample_every-th call is timed, and its time counted sample_every times. Every
+    report_every documents read, the totals are printed and, if metrics_file is given, saved to it: a .csv gets a
+    row per stage and component appended, anything else is overwritten with a json snapshot. When profile is
+    False every call is a no-op.
+    """
+
+    def __init__(self, profile, metrics_file=None, sample_every=1, report_every=100000):
+        self.i = 0
+        self.profile = profile
+        self.metrics_file = metrics_file
+        self.sample_every = sample_every
+        self.report_every = report_every
+        self.started = time.perf_counter_ns()
+        self.calls = collections.Counter()
+        # (stage, component) -> [ns, docs, bytes]
+        self.totals = collections.defaultdict(lambda: [0, 0, 0])
+        self.queues = {}
+
+    def _sampled(self, stage, component):
+        self.calls[stage, component] += 1
+        return self.calls[stage, component] % self.sample_every == 0
+
+    def add(self, stage, component, ns, docs=1, nbytes=0):
+        total = self.totals[stage, component]
+        total[0] += ns * self.sample_every
+        total[1] += docs * self.sample_every
+        total[2] += nbytes * self.sample_every
+
+    def stage(self, stage, component=None, nbytes=0):
+        if not self.profile or not self._sampled(stage, component):
+            return _null
+        return _Timer(self, stage, component, nbytes)
+
+    def watch_queue(self, name, queue):
+        """ Report the depth of queue (anything with qsize()) with the metrics. """
+        self.queues[name] = queue
+
+    def measured_next(self, name, iter):
+        if not self.profile:
+            # no-op
+            return next(iter)
+
+        self.i += 1
+        if self._sampled('read', name):
+            start = time.perf_counter_ns()
+            doc = next(iter)
+            self.add('read', name, time.perf_counter_ns() - start, nbytes=utf8len(doc[0]))
+        else:
+            doc = next(iter)
+
+        if self.i % self.report_every == 0:
+            self.report()
+
+        return doc
+
+    def queue_depths(self):
+        depths = {}
+        for name, queue in self.queues.items():
+            try:
+                depths[name] = queue.qsize()
+            except NotImplementedError:
+                # multiprocessing queues can't tell on macOS
+                pass
+        return depths
+
+    def metrics(self):
+        rows = []
+        for (stage, component), (ns, docs, nbytes) in sorted(self.totals.items(), key=lambda x: (x[0][0], str(x[0][1]))):
+            seconds = ns / 1e9
+            rows.append({
+                'stage': stage,
+                'component': component,
+                'seconds': seconds,
+                'docs': docs,
+                'bytes': nbytes,
+                'docs_per_s': docs / seconds if seconds else None,
+                'bytes_per_s': nbytes / seconds if seconds else None,
+            })
+        return rows
+
+    def report(self):
+        elapsed = (time.perf_counter_ns() - self.started) / 1e9
+        rows = self.metrics()
+        depths = self.queue_depths()
+
+        for row in sorted(rows, key=lambda x: x['seconds']):
+            print((row['stage'] + ' ' + str(row['component'] or '')).ljust(30), '{:.8f}'.format(row['seconds'] / row['docs']), str(row['docs']).rjust(8), '{:.4f}'.format(row['seconds']))
+        for name, depth in depths.items():
+            print('queue', name.ljust(24), depth)
+
+        if self.metrics_file is None:
+            return
+
+        if self.metrics_file.endswith('.csv'):
+            new = not os.path.exists(self.metrics_file)
+            with open(self.metrics_file, 'a', newline='') as fh:
+                writer = csv.DictWriter(fh, ['elapsed', 'stage', 'component', 'seconds', 'docs', 'bytes', 'docs_per_s', 'bytes_per_s', 'queue_depth'])
+                if new: writer.writeheader()
+                for row in rows:
+                    writer.writerow({'elapsed': elapsed, **row})
+                for name, depth in depths.items():
+                    writer.writerow({'elapsed': elapsed, 'stage': 'queue', 'component': name, 'queue_depth': depth})
+        else:
+            with open(self.metrics_file + '.tmp', 'w') as fh:
+                json.dump({'elapsed': elapsed, 'stages': rows, 'queue_depths': depths}, fh, indent=2)
+            os.replace(self.metrics_file + '.tmp', self.metrics_file)
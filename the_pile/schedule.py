@@ -0,0 +1,54 @@
+import numpy as np
+
+
+class ByteQuotaScheduler:
+    """ Picks which component each document comes from so that every component's share of the output bytes tracks
+    its target share.
+
+    Documents are scheduled chunk_docs at a time. Each chunk gives a component enough documents (at its mean
+    document size) to cover its byte deficit: target share of the bytes output by the end of the chunk, minus what
+    it has actually output so far. The documents of each component are then spread evenly over the chunk with a
+    random phase, so any stretch of the output is close to the target mixture, and a component that came out
+    bigger or smaller than expected is corrected in the next chunk.
+    """
+
+    def __init__(self, shares, doc_sizes, chunk_docs=1000, seed=42, state=None):
+        self.shares = np.asarray(shares, dtype=np.float64) / np.sum(shares)
+        self.doc_sizes = np.asarray(doc_sizes, dtype=np.float64)
+        self.chunk_docs = chunk_docs
+        self.seed = seed
+
+        # mean document size of the target mixture
+        self.chunk_bytes = chunk_docs / np.sum(self.shares / self.doc_sizes)
+
+        self.chunk_no = 0
+        self.emitted = np.zeros(len(self.shares))
+        if state is not None:
+            self.chunk_no = state['chunk_no']
+            self.emitted = np.array(state['emitted'], dtype=np.float64)
+
+    def state(self):
+        """ json-serializable state; restoring it repeats the next chunk exactly. """
+        return {'chunk_no': self.chunk_no, 'emitted': self.emitted.tolist()}
+
+    def add(self, component, size):
+        self.emitted[component] += size
+
+    def next_chunk(self):
+        """ Component index of each document in the next chunk. Call add() for every document before asking for
+        the chunk after. """
+        rng = np.random.RandomState([self.seed, self.chunk_no])
+        self.chunk_no += 1
+
+        target = self.shares * (self.emitted.sum() + self.chunk_bytes)
+        counts = np.maximum(target - self.emitted, 0) / self.doc_sizes
+        # round stochastically so fractional documents aren't lost or gained on average
+        counts = np.floor(counts + rng.random_sample(len(counts))).astype(np.int64)
+        if counts.sum() == 0:
+            counts[np.argmax(target - self.emitted)] = 1
+
+        components = np.repeat(np.arange(len(counts)), counts)
+        # document j of a component with n documents in this chunk lands at (j + phase) / n
+        starts = np.cumsum(counts) - counts
+        positions = (np.arange(len(components)) - starts[components] + rng.random_sample(len(counts))[components]) / counts[components]
+        return components[np.argsort(positions, kind='stable')]
@@ -0,0 +1,187 @@
+import os
+import time
+import multiprocessing as mp
+from json import JSONDecoder
+
+import ujson as json
+from tqdm import tqdm
+
+from .utils import readf, writef, batched
+
+
+def _parse(line):
+    ob = json.loads(line)
+    return ob['text'], ob['meta']
+
+
+def _serialize(doc):
+    text, meta = doc
+    return json.dumps({'text': text, 'meta': meta}).encode('utf-8') + b'\n'
+
+
+_meta_decoder = JSONDecoder()
+
+
+class LazyRecord:
+    """ A jsonl.zst line that is only decoded as far as it is used.
+
+    meta is found by searching back from the end of the line for the "meta" key, which can't occur unescaped
+    inside the text, so reading it never touches the text; if the line doesn't end with meta, the whole line is
+    parsed instead. text decodes the whole line. Assigning to text or meta, or changing meta in place after
+    calling mark_changed(), makes to_bytes() serialize the record again; otherwise it returns the original line.
+    """
+
+    __slots__ = ('line', '_text', '_meta', 'changed')
+
+    def __init__(self, line):
+        self.line = line
+        self._text = None
+        self._meta = None
+        self.changed = False
+
+    def _load(self):
+        ob = json.loads(self.line)
+        if self._text is None:
+            self._text = ob['text']
+        if self._meta is None:
+            self._meta = ob['meta']
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            self._meta = self._lazy_meta()
+            if self._meta is None:
+                self._load()
+        return self._meta
+
+    def _lazy_meta(self):
+        i = self.line.rfind(b'"meta":')
+        if i < 0:
+            return None
+        rest = self.line[i + len(b'"meta":'):].decode('utf-8').lstrip()
+        try:
+            meta, end = _meta_decoder.raw_decode(rest)
+        except ValueError:
+            return None
+        # a key called "meta" nested inside meta leaves more than the closing brace
+        if not isinstance(meta, dict) or rest[end:].strip() != '}':
+            return None
+        return meta
+
+    @meta.setter
+    def meta(self, meta):
+        self._meta = meta
+        self.changed = True
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._load()
+        return self._text
+
+    @text.setter
+    def text(self, text):
+        self._text = text
+        self.changed = True
+
+    def mark_changed(self):
+        self.changed = True
+
+    def to_bytes(self):
+        if not self.changed:
+            return self.line
+        return _serialize((self.text, self.meta))
+
+
+def _apply(fn, mode, items, batch_size):
+    if mode == 'map':
+        return map(fn, items)
+    if mode == 'filter':
+        return filter(fn, items)
+    if mode == 'flat_map':
+        return (y for x in items for y in fn(x))
+    if mode == 'batch':
+        return (y for batch in batched(items, batch_size) for y in fn(batch))
+    raise ValueError('Unknown mode ' + mode)
+
+
+def _counted(it, counts, key, size=len):
+    for x in it:
+        counts[key] += 1
+        counts[key + '_bytes'] += size(x)
+        yield x
+
+
+def _process_shard(job):
+    f, out, marker, fn, mode, parse, batch_size, threads = job
+    tmp = out + '.tmp'
+
+    if os.path.exists(marker):
+        # crashed between writing the marker and moving the output into place
+        if os.path.exists(tmp):
+            os.replace(tmp, out)
+        return None
+
+    start = time.time()
+    counts = {'in': 0, 'in_bytes': 0, 'out': 0, 'out_bytes': 0}
+    items = _counted(readf(f), counts, 'in')
+    if parse == 'lazy':
+        items = map(LazyRecord, items)
+    elif parse:
+        items = map(_parse, items)
+    items = _apply(fn, mode, items, batch_size)
+    if parse == 'lazy':
+        items = map(LazyRecord.to_bytes, items)
+    elif parse:
+        items = map(_serialize, items)
+    writef(tmp, _counted(items, counts, 'out'), threads=threads)
+
+    counts['seconds'] = time.time() - start
+    # the marker goes first, so a shard is never processed twice even if this is interrupted before the rename
+    with open(marker, 'w') as fh:
+        json.dump(counts, fh)
+    os.replace(tmp, out)
+    return counts
+
+
+def process_shards(fn, files, out_dir=None, name=None, mode='map', parse=False, batch_size=10000, workers=mp.cpu_count(),
+                   initializer=None, initargs=(), threads=2):
+    """ Apply fn to every line of every jsonl.zst shard in files, one shard per worker process.
+
+    mode is 'map' (fn returns the new line), 'filter' (fn says whether to keep the line), 'flat_map' (fn returns
+    any number of lines) or 'batch' (fn gets a list of up to batch_size lines and returns the lines to write). With
+    parse=True, fn works on (text, meta) pairs instead of raw lines, and with parse='lazy' on LazyRecords, so that
+    lines fn doesn't change are written back as they were without being decoded or encoded.
+
+    Output goes to out_dir under the same file name, or replaces each shard if out_dir is None. Every shard is
+    written to a temporary file and moved into place when done, and a marker named after the job (name, by default
+    fn's name) records that it's done, so rerunning skips finished shards and concurrent jobs don't collide.
+    Returns the total line and byte counts in and out.
+    """
+    name = name or fn.__name__
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+
+    jobs = []
+    for f in files:
+        out = f if out_dir is None else os.path.join(out_dir, os.path.basename(f))
+        jobs.append((f, out, out + '.' + name + '.done', fn, mode, parse, batch_size, threads))
+
+    totals = {'shards': 0, 'skipped': 0, 'in': 0, 'in_bytes': 0, 'out': 0, 'out_bytes': 0}
+    start = time.time()
+    with mp.Pool(workers, initializer=initializer, initargs=initargs) as pool:
+        pbar = tqdm(pool.imap_unordered(_process_shard, jobs), total=len(jobs), unit='shard')
+        for counts in pbar:
+            if counts is None:
+                totals['skipped'] += 1
+                continue
+
+            totals['shards'] += 1
+            for key in ['in', 'in_bytes', 'out', 'out_bytes']:
+                totals[key] += counts[key]
+            elapsed = time.time() - start
+            pbar.set_postfix(docs_per_s='{:.0f}'.format(totals['in'] / elapsed), mb_per_s='{:.1f}'.format(totals['in_bytes'] / elapsed / 2 ** 20))
+
+    print('{}: {} shards processed ({} already done), {} -> {} lines, {:.1f} docs/s'.format(
+        name, totals['shards'], totals['skipped'], totals['in'], totals['out'], totals['in'] / max(time.time() - start, 1e-9)))
+    return totals
@@ -0,0 +1,101 @@
+import os
+import io
+import heapq
+import random
+import struct
+import hashlib
+import tempfile
+
+import zstandard
+
+from .utils import readf, writef, concat, rm_if_exists
+
+
+# (sort key, line length) header in front of every line in a spilled run
+_record = struct.Struct('<QI')
+
+# rough python overhead per buffered line: the tuple, the key int, the bytes header and the list slot
+_LINE_OVERHEAD = 150
+
+
+def line_hash(line):
+    """ Stable 64-bit hash of a line, the same on every machine and every run. """
+    return int.from_bytes(hashlib.blake2b(line, digest_size=8).digest(), 'little')
+
+
+def is_holdout(line, holdout_frac):
+    return line_hash(line) < holdout_frac * 2 ** 64
+
+
+def _write_run(fname, run):
+    run.sort(key=lambda x: x[0])
+    writef(fname, (_record.pack(key, len(line)) + line for key, line in run), threads=0)
+
+
+def _read_run(fname):
+    with open(fname, 'rb') as fh:
+        cctx = zstandard.ZstdDecompressor()
+        reader = io.BufferedReader(cctx.stream_reader(fh))
+        while True:
+            header = reader.read(_record.size)
+            if not header:
+                return
+            key, size = _record.unpack(header)
+            yield key, reader.read(size)
+
+
+def external_shuffle(lines, mem_budget, tmpdir=None, seed=42):
+    """ Yield lines in a uniformly random order, keeping at most about mem_budget bytes of them in memory.
+
+    Every line gets a random key; whenever the buffer is full it is sorted by key and spilled to disk as a run,
+    and the runs are then merged back together by key.
+    """
+    rnd = random.Random(seed)
+    tmpdir = tempfile.mkdtemp(prefix='shuffle_', dir=tmpdir)
+    runs = []
+
+    try:
+        run = []
+        run_bytes = 0
+        for line in lines:
+            run.append((rnd.getrandbits(64), line))
+            run_bytes += len(line) + _LINE_OVERHEAD
+
+            if run_bytes > mem_budget:
+                runs.append(tmpdir + '/run{}.zst'.format(len(runs)))
+                _write_run(runs[-1], run)
+                run = []
+                run_bytes = 0
+
+        # everything fit in memory, no need to touch the disk
+        if not runs:
+            run.sort(key=lambda x: x[0])
+            for _, line in run:
+                yield line
+            return
+
+        runs.append(tmpdir + '/run{}.zst'.format(len(runs)))
+        _write_run(runs[-1], run)
+        del run
+
+        for _, line in heapq.merge(*map(_read_run, runs), key=lambda x: x[0]):
+            yield line
+    finally:
+        rm_if_exists(tmpdir)
+
+
+def shuffle_holdout(infiles, fout, fouth, holdout_frac=0.01, mem_budget=8 * 1024 ** 3, tmpdir=None, seed=42):
+    """ Shuffle the lines of infiles into fout, sending a stable holdout_frac of them to fouth instead. """
+    with open(fout, 'wb') as fh, open(fouth, 'wb') as fhh:
+        # a compressor can't be shared between two streams that are written at the same time
+        compressor = zstandard.ZstdCompressor(level=3, threads=8).stream_writer(fh)
+        compressor_h = zstandard.ZstdCompressor(level=3, threads=8).stream_writer(fhh)
+
+        for line in external_shuffle(concat(map(readf, infiles)), mem_budget, tmpdir=tmpdir, seed=seed):
+            if is_holdout(line, holdout_frac):
+                compressor_h.write(line)
+            else:
+                compressor.write(line)
+
+        compressor.flush(zstandard.FLUSH_FRAME)
+        compressor_h.flush(zstandard.FLUSH_FRAME)
@@ -0,0 +1,173 @@
+import os
+import json
+import collections
+
+import numpy as np
+
+
+class Moments:
+    """ Count, mean and variance of a stream (Welford), updated a batch at a time and mergeable (Chan et al.). """
+
+    def __init__(self, n=0, mean=0., m2=0.):
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+
+    def merge(self, other):
+        n = self.n + other.n
+        if n == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta ** 2 * self.n * other.n / n
+        self.n = n
+        return self
+
+    def update(self, xs):
+        xs = np.asarray(xs, dtype=np.float64)
+        if len(xs):
+            mean = xs.mean()
+            self.merge(Moments(len(xs), mean, ((xs - mean) ** 2).sum()))
+        return self
+
+    def variance(self):
+        """ Population variance. """
+        return self.m2 / self.n if self.n else 0.
+
+    def stddev(self):
+        return self.variance() ** 0.5
+
+    def to_json(self):
+        return {'n': self.n, 'mean': self.mean, 'm2': self.m2}
+
+    @classmethod
+    def from_json(cls, ob):
+        return cls(ob['n'], ob['mean'], ob['m2'])
+
+
+class LogHistogram:
+    """ Counts of non-negative values in bins evenly spaced in log2(1 + x), bins_per_octave to a doubling. Fixed
+    bins, so histograms merge by adding counts; quantiles are accurate to within a bin (about 9% of the value with
+    the default 8 bins per octave). """
+
+    def __init__(self, bins_per_octave=8, octaves=48, counts=None):
+        self.bins_per_octave = bins_per_octave
+        self.octaves = octaves
+        self.counts = np.zeros(bins_per_octave * octaves, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+
+    def edges(self):
+        return np.exp2(np.arange(len(self.counts) + 1) / self.bins_per_octave) - 1
+
+    def update(self, xs):
+        xs = np.maximum(np.asarray(xs, dtype=np.float64), 0)
+        bins = np.minimum((np.log2(1 + xs) * self.bins_per_octave).astype(np.int64), len(self.counts) - 1)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+        return self
+
+    def merge(self, other):
+        assert (self.bins_per_octave, self.octaves) == (other.bins_per_octave, other.octaves)
+        self.counts += other.counts
+        return self
+
+    def quantile(self, q):
+        """ Value below which a fraction q of the data lies, interpolated linearly within its bin. """
+        total = self.counts.sum()
+        if total == 0:
+            return 0.
+        cum = np.cumsum(self.counts)
+        i = int(np.searchsorted(cum, q * total))
+        i = min(i, len(self.counts) - 1)
+        before = cum[i] - self.counts[i]
+        edges = self.edges()
+        frac = (q * total - before) / self.counts[i] if self.counts[i] else 0.
+        return edges[i] + frac * (edges[i + 1] - edges[i])
+
+    def to_json(self):
+        # only the populated range, to keep files small
+        nz = np.flatnonzero(self.counts)
+        start = int(nz[0]) if len(nz) else 0
+        end = int(nz[-1]) + 1 if len(nz) else 0
+        return {'bins_per_octave': self.bins_per_octave, 'octaves': self.octaves, 'start': start, 'counts': self.counts[start:end].tolist()}
+
+    @classmethod
+    def from_json(cls, ob):
+        h = cls(ob['bins_per_octave'], ob['octaves'])
+        h.counts[ob['start']:ob['start'] + len(ob['counts'])] = ob['counts']
+        return h
+
+
+class CountMap:
+    """ How often each value occurs. """
+
+    def __init__(self, counts=None):
+        self.counts = collections.Counter(counts or {})
+
+    def update(self, xs):
+        values, counts = np.unique(np.asarray(xs), return_counts=True)
+        for v, n in zip(values.tolist(), counts.tolist()):
+            self.counts[v] += n
+        return self
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        return self
+
+    def to_json(self):
+        return {'counts': dict(self.counts)}
+
+    @classmethod
+    def from_json(cls, ob):
+        return cls(ob['counts'])
+
+
+_kinds = {cls.__name__: cls for cls in [Moments, LogHistogram, CountMap]}
+
+
+class Sketches:
+    """ Named sketches, e.g. one per (component, attribute), that merge and save as a whole. """
+
+    def __init__(self):
+        self.sketches = {}
+
+    def get(self, key, cls):
+        """ The sketch for key, created empty if there isn't one yet. key is a tuple of strings. """
+        if key not in self.sketches:
+            self.sketches[key] = cls()
+        return self.sketches[key]
+
+    def __getitem__(self, key):
+        return self.sketches[key]
+
+    def __contains__(self, key):
+        return key in self.sketches
+
+    def keys(self):
+        return self.sketches.keys()
+
+    def merge(self, other):
+        for key, sketch in other.sketches.items():
+            if key in self.sketches:
+                self.sketches[key].merge(sketch)
+            else:
+                self.sketches[key] = sketch
+        return self
+
+    def to_json(self):
+        return [{'key': list(key), 'kind': type(sketch).__name__, 'value': sketch.to_json()} for key, sketch in self.sketches.items()]
+
+    @classmethod
+    def from_json(cls, ob):
+        sketches = cls()
+        for x in ob:
+            sketches.sketches[tuple(x['key'])] = _kinds[x['kind']].from_json(x['value'])
+        return sketches
+
+    def save(self, fname):
+        with open(fname + '.tmp', 'w') as fh:
+            json.dump(self.to_json(), fh)
+        os.replace(fname + '.tmp', fname)
+
+    @classmethod
+    def load(cls, fname):
+        with open(fname) as fh:
+            return cls.from_json(json.load(fh))
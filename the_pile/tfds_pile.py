@@ -2,11 +2,10 @@
 
 import tensorflow_datasets as tfds
 import tensorflow as tf
-import io
-import zstandard
-import jsonlines
 import os
 
+from the_pile.pile_reader import PileReader
+
 """
 Tips for Colab - Change _PILE_SPLITS below to increments of 8 to allow downloading and storing in GCS
 After every 8 parts, tfds will flush the tempfiles from local and it will be cached on GCS, allowing reuse
@@ -53,15 +52,6 @@ ds.map(lambda item: simple_tokenization(item), num_parallel_calls=tf.data.experi
 
 """
 
-try:
-    import simdjson as json
-except ImportError:
-    print('Installing simdjson library')
-    os.system('pip install -q pysimdjson')
-    import simdjson as json
-    parser = json.Parser()
-
-
 _DESCRIPTION = """
 The Pile is a large, diverse, open source language modelling data set 
 that consists of many smaller datasets combined together. 
@@ -95,39 +85,9 @@ _RELEASE_NOTES = {
 _NAME = 'the_pile'
 _FILE_FORMAT = 'jsonlines'
 
-def json_parser(x):
-    try:
-        line = parser.parse(x).as_dict()
-        return line
-    except ValueError:
-        return x
-
-class PileReader:
-    def __init__(self, filenames, para_joiner='\n\n'):
-        if not isinstance(filenames, list):
-            filenames = [filenames]
-        self.filenames = filenames
-        self.para_joiner = para_joiner
-
-    def _read_fn(self, filename):
-        with tf.io.gfile.GFile(filename, 'rb+') as f:
-            cctx = zstandard.ZstdDecompressor()
-            reader_stream = io.BufferedReader(cctx.stream_reader(f))
-            reader = jsonlines.Reader(reader_stream, loads=json_parser)
-            for item in reader:
-                result = dict()
-                if isinstance(item, str):
-                    result['text'] = item
-                else:
-                    text = item['text']
-                    if isinstance(text, list):
-                        text = self.para_joiner.join(text)
-                        result['text'] = text
-                yield result
-    
-    def __iter__(self):
-        for filename in self.filenames:
-            return self._read_fn(filename)
+# fixed, so that the example order and keys don't depend on the machine building the dataset
+_INTERLEAVE = 8
+_NUM_WORKERS = os.cpu_count()
 
 
 class ThePileConfig(tfds.core.BuilderConfig):
@@ -169,7 +129,7 @@ class ThePile(tfds.core.GeneratorBasedBuilder):
         ]
 
     def _generate_examples(self, paths):
-        pipeline = PileReader(paths)
+        pipeline = PileReader(paths, interleave=_INTERLEAVE, num_workers=_NUM_WORKERS)
         for x, result in enumerate(pipeline):
             if result:
                 idx = f'{x}_the_pile'
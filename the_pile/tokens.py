@@ -0,0 +1,184 @@
+import os
+import json
+import random
+import itertools
+import collections
+import multiprocessing as mp
+
+import numpy as np
+
+from .manifest import MANIFEST_DIR, manifest_path, fingerprint
+from .utils import utf8len, batched
+
+
+def token_dtype(vocab_size):
+    return np.uint16 if vocab_size <= 2 ** 16 else np.uint32
+
+
+def _init_tokenizer(name):
+    global _tokenizer
+    from transformers import AutoTokenizer
+    _tokenizer = AutoTokenizer.from_pretrained(name)
+
+
+def _tokenize(batch):
+    # one call per batch of documents rather than one per document
+    eot = _tokenizer.eos_token_id
+    if eot is None:
+        raise ValueError('{} has no end of text token to separate documents with'.format(_tokenizer.name_or_path))
+    dtype = token_dtype(len(_tokenizer))
+    ids = _tokenizer([doc for doc, _ in batch])['input_ids']
+    return [(np.array(x + [eot], dtype=dtype), meta) for x, (_, meta) in zip(ids, batch)]
+
+
+def _imap_bounded(pool, fn, items, max_pending):
+    # like pool.imap, but items is only read from this thread and at most max_pending results are waiting at once
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.apply_async(fn, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def tokenize_documents(documents, tokenizer='gpt2', workers=mp.cpu_count(), batch_size=256, max_pending=None):
+    """ (token ids followed by the end of text token, meta) for each (doc, meta) in documents, in order. Runs a pool
+    of workers that each load tokenizer and tokenize batch_size documents at a time, with at most max_pending
+    batches (default twice the workers) read ahead of the caller. """
+    with mp.Pool(workers, initializer=_init_tokenizer, initargs=(tokenizer,)) as pool:
+        for batch in _imap_bounded(pool, _tokenize, batched(documents, batch_size), max_pending or 2 * workers):
+            yield from batch
+
+
+def _count_tokens(docs):
+    return [len(ids) for ids in _tokenizer(docs)['input_ids']]
+
+
+def token_counter(tokenizer='gpt2', workers=mp.cpu_count()):
+    """ A pool for count_tokens. """
+    return mp.Pool(workers, initializer=_init_tokenizer, initargs=(tokenizer,))
+
+
+def count_tokens(pool, docs, batch_size=64):
+    """ Exact number of tokens in each of docs, tokenized in batches on pool. """
+    return [n for counts in pool.map(_count_tokens, list(batched(docs, batch_size))) for n in counts]
+
+
+def _sample_documents(dataset, k, scan_docs):
+    if dataset.has_index():
+        return [doc for doc, _ in dataset.sample(min(k, len(dataset.index())))]
+
+    # without an index, a reservoir sample of the first scan_docs documents rather than a pass over all of them
+    rnd = random.Random(42)
+    sample = []
+    for i, (doc, _) in enumerate(itertools.islice(dataset.documents(), scan_docs)):
+        if i < k:
+            sample.append(doc)
+        else:
+            j = rnd.randrange(i + 1)
+            if j < k:
+                sample[j] = doc
+    return sample
+
+
+def bytes_per_token(dataset, tokenizer='gpt2', sample_docs=1000, scan_docs=10000):
+    """ utf-8 bytes per token in a random sample of dataset's documents: from the whole dataset if it has an index,
+    otherwise from its first scan_docs documents. Cached next to the manifest until the sources change. """
+    fname = manifest_path(dataset)[:-len('.json')] + '.tokens.json'
+    fp = fingerprint(dataset.source_paths())
+    if os.path.exists(fname):
+        with open(fname) as fh:
+            cached = json.load(fh)
+        if cached['fingerprint'] == fp and cached['tokenizer'] == tokenizer and cached['sample_docs'] == sample_docs:
+            return cached['bytes_per_token']
+
+    _init_tokenizer(tokenizer)
+    docs = _sample_documents(dataset, sample_docs, scan_docs)
+    result = sum(map(utf8len, docs)) / max(1, sum(_count_tokens(docs)))
+
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    with open(fname, 'w') as fh:
+        json.dump({'fingerprint': fp, 'tokenizer': tokenizer, 'sample_docs': sample_docs, 'bytes_per_token': result}, fh)
+    return result
+
+
+class TokenWriter:
+    """ Writes tokenized documents as flat shards.
+
+    For shard i in out_dir there is tokens_i.bin, every token of its documents back to back; tokens_i.idx.npy, the
+    offset where each document starts plus the total at the end; and tokens_i.tags.npy, the component of each
+    document as an index into components.json. A shard is closed off once it holds shard_tokens tokens.
+    """
+
+    def __init__(self, out_dir, dtype=None, shard_tokens=2 ** 30):
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        # taken from the first document's ids if not given
+        self.dtype = dtype
+        self.shard_tokens = shard_tokens
+        self.components = []
+        self.i = 0
+        self._open()
+
+    def _path(self, i):
+        return self.out_dir + '/tokens_{}'.format(i)
+
+    def _open(self):
+        self.fh = open(self._path(self.i) + '.bin.tmp', 'wb')
+        self.offsets = [0]
+        self.tags = []
+
+    def add_tokens(self, ids, component):
+        if component not in self.components:
+            self.components.append(component)
+        if self.dtype is None:
+            self.dtype = np.asarray(ids).dtype
+        self.fh.write(np.asarray(ids, dtype=self.dtype).tobytes())
+        self.offsets.append(self.offsets[-1] + len(ids))
+        self.tags.append(self.components.index(component))
+
+        if self.offsets[-1] >= self.shard_tokens:
+            self._close()
+            self.i += 1
+            self._open()
+
+    def _close(self):
+        self.fh.close()
+        path = self._path(self.i)
+        np.save(path + '.idx.npy', np.array(self.offsets, dtype=np.int64))
+        np.save(path + '.tags.npy', np.array(self.tags, dtype=np.uint16))
+        os.rename(path + '.bin.tmp', path + '.bin')
+
+    def close(self):
+        if len(self.offsets) > 1:
+            self._close()
+        else:
+            self.fh.close()
+            os.remove(self._path(self.i) + '.bin.tmp')
+
+        with open(self.out_dir + '/components.json', 'w') as fh:
+            json.dump({'components': self.components, 'dtype': np.dtype(self.dtype or np.uint16).name}, fh)
+
+
+class TokenShard:
+    """ Zero-copy access to one shard written by TokenWriter. """
+
+    def __init__(self, out_dir, i):
+        with open(out_dir + '/components.json') as fh:
+            info = json.load(fh)
+        path = out_dir + '/tokens_{}'.format(i)
+
+        self.components = info['components']
+        self.tokens = np.memmap(path + '.bin', dtype=info['dtype'], mode='r')
+        self.offsets = np.load(path + '.idx.npy', mmap_mode='r')
+        self.tags = np.load(path + '.tags.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __getitem__(self, i):
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    def component(self, i):
+        return self.components[self.tags[i]]
@@ -7,7 +7,18 @@ import collections
 from pathlib import Path
 import tarfile
 import shutil
-
+import itertools
+import multiprocessing as mp
+import traceback
+import io
+import json
+import mmap
+import queue
+import threading
+from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+
+import zstandard
 import gdown
 from tqdm import tqdm
 from best_download import download_file
@@ -25,17 +36,27 @@ def download(fname, checksum, sources, extract=False):
     parentdir = Path(fname).parent
     os.makedirs(parentdir, exist_ok=True)
 
+    # direct sources are mirrors of the same file, so they're all handed to the downloader together
+    mirrors = [source.url for source in sources if source.type == 'direct']
+    sources = ([Source('direct', mirrors)] if mirrors else []) + [source for source in sources if source.type != 'direct']
+
     for source in sources:
         try:
             # todo: implement torrent handling
             if source.type == 'direct':
-                download_file(source.url, fname, checksum)
+                from .downloader import fetch, fetch_and_extract
+                if extract:
+                    # extracted in the same pass as the download; the archive itself never hits the disk
+                    fetch_and_extract(fname, checksum, source.url)
+                    fwrite(fname + '.done', checksum)
+                    return
+                fetch(fname, checksum, source.url)
             elif source.type == 'gdrive':
                 if os.path.exists(fname):
                     try:
                         print(fname, 'already exists.')
                         sha256sum(fname, expected=checksum)
-                        touch(fname + '.done')
+                        fwrite(fname + '.done', checksum)
                         return
                     except AssertionError:
                         print('{} exists but doesn\'t match checksum!'.format(fname))
@@ -49,7 +70,9 @@ def download(fname, checksum, sources, extract=False):
             if extract:
                 tar_xf(fname)
                 rm_if_exists(fname)
-            touch(fname + '.done')
+                rm_if_exists(fname + '.sha256')
+            # the checksum is kept in the marker so that verify_downloads can re-check the file later
+            fwrite(fname + '.done', checksum)
             return
         except SystemExit:
             raise
@@ -67,10 +90,93 @@ def download(fname, checksum, sources, extract=False):
     raise Exception('Failed to download {} from any source'.format(fname))
 
 
+class MemberStats:
+    """ Checksum, size and document count of a file, computed incrementally as its bytes go by. """
+
+    def __init__(self, name):
+        self.name = name
+        self.h = hashlib.sha256()
+        self.size = 0
+        self.num_docs = None
+        self.uncompressed_size = None
+        self._dobj = None
+
+        if name.endswith('.jsonl.zst'):
+            self.num_docs = 0
+            self.uncompressed_size = 0
+            self._dobj = zstandard.ZstdDecompressor().decompressobj()
+        elif name.endswith('.jsonl'):
+            self.num_docs = 0
+        elif name.endswith('.txt'):
+            # directory-of-files components have one document per file
+            self.num_docs = 1
+
+    def update(self, chunk):
+        self.h.update(chunk)
+        self.size += len(chunk)
+
+        if self._dobj is not None:
+            while chunk:
+                out = self._dobj.decompress(chunk)
+                self.num_docs += out.count(b'\n')
+                self.uncompressed_size += len(out)
+                chunk = b''
+                if self._dobj.eof:
+                    # files written in several commits have several frames
+                    chunk = self._dobj.unused_data
+                    self._dobj = zstandard.ZstdDecompressor().decompressobj()
+        elif self.name.endswith('.jsonl'):
+            self.num_docs += chunk.count(b'\n')
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'size': self.size,
+            'sha256': self.h.hexdigest(),
+            'num_docs': self.num_docs,
+            'uncompressed_size': self.uncompressed_size,
+        }
+
+
+def stream_tar_xf(fileobj, parentdir, members=None):
+    """ Extract a tar stream into parentdir without seeking, computing MemberStats for every file in the same pass.
+    Files are appended to members as soon as they're started, so callers can clean up after a failure. """
+    parentdir = os.path.realpath(parentdir)
+    if members is None:
+        members = []
+    tf = tarfile.open(fileobj=fileobj, mode='r|*')
+    for member in tf:
+        if not member.isfile():
+            continue
+        src = tf.extractfile(member)
+        dest = os.path.realpath(os.path.join(parentdir, member.name))
+        if not dest.startswith(parentdir + os.sep):
+            raise Exception('Refusing to extract {} outside of {}'.format(member.name, parentdir))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+        stats = MemberStats(member.name)
+        members.append(stats)
+        with open(dest, 'wb') as out:
+            for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                stats.update(chunk)
+                out.write(chunk)
+        os.utime(dest, (member.mtime, member.mtime))
+
+    return [stats.to_dict() for stats in members]
+
+
+def write_members(x, members):
+    """ Keep the per-file stats of an extracted archive next to where it was extracted, for verify_downloads. """
+    with open(x + '.members.json', 'w') as fh:
+        json.dump(members, fh, indent=2)
+
+
 def tar_xf(x):
     parentdir = Path(x).parent
-    tf = tarfile.open(x)
-    tf.extractall(parentdir)
+    with open(x, 'rb') as fh:
+        members = stream_tar_xf(fh, parentdir)
+    write_members(x, members)
+    return members
 
 class ExitCodeError(Exception): pass
 
@@ -101,15 +207,194 @@ def ls(x):
     return [x + '/' + fn for fn in stableorder(os.listdir(x))]
 
 
+_json_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+def iter_json_array(fh, bufsize=1024 * 1024):
+    """ Yield the elements of the top-level JSON array in a text file one at a time, holding only about one
+    element (plus bufsize characters) in memory instead of the whole file like json.load. """
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill(need_more):
+        nonlocal buf, pos, eof
+        # read more the longer an element gets, so huge elements don't get re-parsed over and over
+        chunk = fh.read(max(bufsize, len(buf) - pos if need_more else 0))
+        buf = buf[pos:] + chunk
+        pos = 0
+        eof = not chunk
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill(False)
+
+    fill(False)
+    skip_whitespace()
+    if buf[pos:pos + 1] != '[':
+        raise ValueError('Expected a JSON array')
+    pos += 1
+
+    skip_whitespace()
+    if buf[pos:pos + 1] == ']':
+        return
+
+    while True:
+        try:
+            ob, end = _json_decoder.raw_decode(buf, pos)
+            # a number cut off by the end of the buffer still parses, so only trust a value once we've seen what follows it
+            complete = eof or (end < len(buf) and buf[end] in _WHITESPACE + ',]')
+        except json.JSONDecodeError:
+            if eof: raise
+            complete = False
+
+        if not complete:
+            fill(True)
+            continue
+
+        yield ob
+        pos = end
+        skip_whitespace()
+        if buf[pos:pos + 1] == ']':
+            return
+        if buf[pos:pos + 1] != ',':
+            raise ValueError('Expected , or ] at position {}'.format(pos))
+        pos += 1
+        skip_whitespace()
+
+
+def readf(f):
+    """ Stream the raw lines of a .jsonl.zst file. """
+    with open(f, 'rb') as fh:
+        cctx = zstandard.ZstdDecompressor()
+        reader = io.BufferedReader(cctx.stream_reader(fh))
+        yield from reader
+
+
+def writef(f, lines, threads=8):
+    with open(f, 'wb') as fh:
+        cctx = zstandard.ZstdCompressor(level=3, threads=threads)
+        compressor = cctx.stream_writer(fh)
+        for line in lines:
+            compressor.write(line)
+        compressor.flush(zstandard.FLUSH_FRAME)
+
+
 def cycle_documents(dataset):
     while True:
-        yield from filter(id, dataset.documents())
+        n = 0
+        for doc in filter(id, dataset.documents()):
+            n += 1
+            yield doc
+        if n == 0:
+            raise ValueError('{} has no documents to cycle through'.format(dataset.name()))
+
+
+def shard_range(n, shard_index, num_shards):
+    """ The [start, end) range of a shard of n documents. """
+    return n * shard_index // num_shards, n * (shard_index + 1) // num_shards
+
+
+def _index_shard(dataset, shard_index, num_shards):
+    index = dataset.index()
+    start, end = shard_range(len(index), shard_index, num_shards)
+    if start >= end:
+        raise ValueError('Shard {} of {} of {} is empty: it only has {} documents'.format(shard_index, num_shards, dataset.name(), len(index)))
+    return index, start, end
+
+
+def _cycle_index_range(index, start, end, offset):
+    # the first pass starts partway in when resuming; every later one reads the whole range
+    skip = offset % (end - start)
+    while True:
+        yield from index.documents(start + skip, end)
+        skip = 0
+
+
+def cycle_shard_documents(dataset, shard_index, num_shards, offset=0):
+    """ Cycle through this shard's share of the dataset, skipping the first offset documents (for resuming).
+
+    With several shards, or when resuming, the documents are read from the dataset's index, starting at the frame
+    the shard's range (or the resumed position) is in, so neither earlier documents nor the ones already consumed
+    are decompressed again. The index is built on first use if there isn't one yet.
+    """
+    if num_shards == 1 and offset == 0:
+        return cycle_documents(dataset)
+
+    index, start, end = _index_shard(dataset, shard_index, num_shards)
+    return _cycle_index_range(index, start, end, offset)
+
+
+def epoch_shard_documents(dataset, shard_index, num_shards, offset=0, seed=42):
+    """ Like cycle_shard_documents, but with an exact shard size from the dataset's index and a fresh shuffle every
+    epoch. Offset counts across epochs, so offset // shard size is the number of epochs already done. """
+    index, start, end = _index_shard(dataset, shard_index, num_shards)
+    return index.epochs(start, end, seed=seed, offset=offset)
+
+
+def _prefetch_worker(dataset, queue, batch_size, batch_bytes, shard_index, num_shards, offset, epochs, seed):
+    try:
+        batch = []
+        nbytes = 0
+        if epochs:
+            docs = epoch_shard_documents(dataset, shard_index, num_shards, offset, seed=seed)
+        else:
+            docs = cycle_shard_documents(dataset, shard_index, num_shards, offset)
+        for doc in docs:
+            batch.append(doc)
+            nbytes += len(doc[0])
+            # a byte limit too, so components of whole books don't pile up gigabytes in the queue
+            if len(batch) >= batch_size or nbytes >= batch_bytes:
+                queue.put((batch, None))
+                batch = []
+                nbytes = 0
+    except:
+        queue.put((None, traceback.format_exc()))
+
+
+def prefetch_documents(dataset, batch_size=1000, batch_bytes=4 * 1024 * 1024, queue_size=16, shard_index=0, num_shards=1, offset=0, epochs=False, seed=42, profiler=None):
+    """ cycle_shard_documents (or epoch_shard_documents), but read ahead in a worker process. Documents come out in
+    the same order. A batch is sent once it has batch_size documents or batch_bytes characters of text, so at most
+    about queue_size * batch_bytes (plus one document per batch) is held in the queue. """
+    queue = mp.Queue(queue_size)
+    proc = mp.Process(target=_prefetch_worker, args=(dataset, queue, batch_size, batch_bytes, shard_index, num_shards, offset, epochs, seed), daemon=True)
+    proc.start()
+    if profiler is not None:
+        profiler.watch_queue('prefetch ' + dataset.name(), queue)
+
+    try:
+        while True:
+            batch, err = queue.get()
+            if err is not None:
+                raise Exception('Prefetch worker for {} failed:\n{}'.format(dataset.name(), err))
+            yield from batch
+    finally:
+        proc.terminate()
+        proc.join()
 
 def concat(xs):
     for x in xs:
         yield from x
 
 
+def batched(it, n):
+    """ Lists of n consecutive items of it, the last one possibly shorter. """
+    batch = []
+    for x in it:
+        batch.append(x)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 def flatMap(f, x):
     return reduce(operator.add, map(f, x), [])
 
@@ -119,23 +404,131 @@ def sha256str(s):
     h.update(s)
     return h.hexdigest()
 
-def sha256sum(filename, expected=None):
-    h  = hashlib.sha256()
-    b  = bytearray(128*1024)
-    mv = memoryview(b)
-    progress = tqdm(total=os.path.getsize(filename), unit="byte", unit_scale=1)
-    tqdm.write(f"Verifying checksum for {filename}")
-    with open(filename, 'rb', buffering=0) as f:
-        for n in iter(lambda : f.readinto(mv), 0):
-            h.update(mv[:n])
-            progress.update(n)
-    progress.close()
+def _read_pipelined(filename, bufsize=16*1024*1024, nbufs=4):
+    # a reader thread fills page-aligned buffers while the caller consumes the previous ones
+    free = queue.Queue()
+    full = queue.Queue()
+    for _ in range(nbufs):
+        free.put(mmap.mmap(-1, bufsize))
+
+    def reader():
+        try:
+            with open(filename, 'rb', buffering=0) as f:
+                while True:
+                    buf = free.get()
+                    n = f.readinto(buf)
+                    full.put((buf, n))
+                    if not n: return
+        except BaseException as e:
+            full.put((e, None))
+
+    t = threading.Thread(target=reader, daemon=True)
+    t.start()
+    while True:
+        buf, n = full.get()
+        if isinstance(buf, BaseException): raise buf
+        if not n: break
+
+        yield memoryview(buf)[:n]
+        free.put(buf)
+    t.join()
+
+
+def _cached_sha256(filename):
+    try:
+        with open(filename + '.sha256') as fh:
+            ob = json.load(fh)
+        st = os.stat(filename)
+        if ob['size'] == st.st_size and ob['mtime'] == st.st_mtime_ns:
+            return ob['sha256']
+    except (OSError, ValueError, KeyError):
+        pass
+
+
+def _save_sha256(filename, digest):
+    st = os.stat(filename)
+    with open(filename + '.sha256.tmp', 'w') as fh:
+        json.dump({'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha256': digest}, fh)
+    os.replace(filename + '.sha256.tmp', filename + '.sha256')
+
+
+def sha256sum(filename, expected=None, progress=None, cache=True):
+    """ Hash a file, or reuse the hash in its .sha256 sidecar if the file hasn't changed since. With cache=False
+    no sidecar is read or written. """
+    digest = _cached_sha256(filename) if cache else None
+
+    if digest is None:
+        h = hashlib.sha256()
+        own_progress = progress is None
+        if own_progress:
+            progress = tqdm(total=os.path.getsize(filename), unit="byte", unit_scale=1)
+            tqdm.write(f"Verifying checksum for {filename}")
+        for mv in _read_pipelined(filename):
+            # hashlib releases the GIL for large buffers, so this overlaps with the next read
+            h.update(mv)
+            progress.update(len(mv))
+            mv.release()
+        if own_progress:
+            progress.close()
+
+        digest = h.hexdigest()
+        if cache:
+            _save_sha256(filename, digest)
+    elif progress is not None:
+        progress.update(os.path.getsize(filename))
     
     if expected:
-        assert h.hexdigest() == expected
+        assert digest == expected
         print('CHECKSUM OK', filename)
     else:
-        print(filename, h.hexdigest())
+        print(filename, digest)
+
+    return digest
+
+
+def sha256sum_many(files, threads=8, cache=True):
+    """ Verify a list of (filename, expected checksum) pairs concurrently. Raises AssertionError naming every mismatch. """
+    progress = tqdm(total=sum(os.path.getsize(f) for f, _ in files), unit="byte", unit_scale=1)
+
+    def check(item):
+        filename, expected = item
+        try:
+            sha256sum(filename, expected, progress=progress, cache=cache)
+            return None
+        except AssertionError:
+            return filename
+
+    with ThreadPoolExecutor(threads) as pool:
+        failed = [f for f in pool.map(check, files) if f is not None]
+    progress.close()
+
+    if failed:
+        raise AssertionError('Checksum mismatch: ' + ', '.join(failed))
+
+
+def verify_downloads(root='components', threads=8):
+    """ Re-verify every downloaded file under root that is still on disk against the checksum in its .done marker,
+    and every file extracted from a downloaded archive against the checksum recorded in its .members.json. """
+    files = []
+    for marker in glob(root + '/**/*.done', recursive=True):
+        fname = marker[:-len('.done')]
+        checksum = fread(marker).strip()
+        if checksum and os.path.isfile(fname):
+            files.append((fname, checksum))
+
+    sha256sum_many(files, threads=threads)
+
+    members = []
+    for members_file in glob(root + '/**/*.members.json', recursive=True):
+        parentdir = os.path.dirname(members_file)
+        with open(members_file) as fh:
+            for member in json.load(fh):
+                fname = os.path.join(parentdir, member['name'])
+                if os.path.isfile(fname):
+                    members.append((fname, member['sha256']))
+
+    # no sidecars inside extracted components, where they'd be taken for data
+    sha256sum_many(members, threads=threads, cache=False)
 
 
 def rm_if_exists(path):